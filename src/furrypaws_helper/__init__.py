@@ -1,4 +1,6 @@
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 logger = logging.getLogger(__name__)
 
@@ -16,3 +18,12 @@ def setup_logging(level=logging.INFO):
     root_logger.setLevel(level)
     root_logger.addHandler(handler)
 
+
+def process_pool(max_workers=None):
+    # Worker processes come from a fork server instead of being forked from
+    # this process, whose other threads may be holding locks (the metrics',
+    # the logging handlers') that a forked child would find locked for good.
+    # They get the same logging set up, as forked ones would have.
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context(method),
+                               initializer=setup_logging, initargs=(logging.getLogger(None).level,))
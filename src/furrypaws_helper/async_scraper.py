@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import pickle
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from urllib.parse import urlsplit
+
+import requests
+
+from furrypaws_helper import process_pool
+from furrypaws_helper.exceptions import LoginFailed
+from furrypaws_helper.metrics import measured, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncScraper(object):
+    # asyncio take on laracna's Scraper: same items, callbacks and results,
+    # but with up to concurrency requests in flight per host, stale cached
+    # pages revalidated with conditional requests, and the callbacks (which
+    # must be picklable, e.g. classmethods) run on a pool of worker processes
+    # (or, with workers=0, on the fetch threads) so parsing never holds up the
+    # fetching.
+    #
+    # Like laracna, every request that goes out waits a random min_delay to
+    # max_delay seconds first, holding its slot, so a host never sees more
+    # than concurrency requests per min_delay.
+    origin = "https://www.furry-paws.com"
+    user_agent = "furrypaws-helper (AsyncScraper)"
+
+    def __init__(self, callbacks=None, cache=None, concurrency=4, workers=None, site=None, timeout=60.0, skip=None,
+                 parse_cache=None, min_delay=None, max_delay=None, user_agent=None):
+        if not callbacks:
+            callbacks = {}
+        self.callbacks = callbacks
+
+        # Same defaults as laracna's Scraper
+        if min_delay is None:
+            min_delay = 1.0
+        if max_delay is None:
+            max_delay = 5.0
+        self.min_delay = max(0.0, min_delay)
+        self.max_delay = max(self.min_delay, max_delay)
+        self.cache = cache
+        self.concurrency = max(1, concurrency)
+        self.workers = workers
+        self.timeout = timeout
+        # Optional skip(item): True for chained items that need not be fetched
+        self.skip = skip
+        # Optional ParseCache, checked before a page goes to the workers
+        self.parse_cache = parse_cache
+
+        # Send the requests to a stand-in for the site (e.g. a local test
+        # server); urls, the cache and the callbacks all still see the real ones
+        self.site = site.rstrip("/") if site else None
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": user_agent or self.user_agent,
+        })
+        self.semaphores = {}
+        self.visited = set()
+        self.results = []
+        self.stats = {
+            "requests": 0,
+            "cached": 0,
+            "revalidated": 0,
+            "errors": 0,
+            "skipped": 0,
+        }
+
+    def load_cookies(self, cookiefile):
+        logger.info("Loading cookies from %s" % cookiefile)
+        with open(cookiefile, "rb") as f:
+            self.session.cookies.update(pickle.load(f))
+
+    def save_cookies(self, cookiefile):
+        logger.info("Saving cookies to %s" % cookiefile)
+        with open(cookiefile, "wb") as f:
+            pickle.dump(self.session.cookies, f)
+
+    def login(self, url, data=None, headers=None, **kwargs):
+        # Takes FurryConfig.get_login_form_data(); done up front, before any
+        # pages are fetched.  Raises LoginFailed unless the site took it.
+        logger.info("POST/%s" % url)
+        response = self.session.post(self.site_url(url), data=data, headers=headers, timeout=self.timeout)
+        logger.info("Got login response: code %d" % response.status_code)
+        if response.status_code >= 400 or not self.session.cookies:
+            raise LoginFailed("Login to %s failed: code %d, %d cookies" %
+                              (url, response.status_code, len(self.session.cookies)))
+        return response.status_code
+
+    def check_login(self, url, response):
+        # Pages need a logged in session; without one the site sends them on
+        # to the front page to log in
+        if response.history and urlsplit(response.url).path in ["", "/"] and urlsplit(url).path not in ["", "/"]:
+            raise LoginFailed("Not logged in: %s was sent on to %s" % (url, response.url))
+
+    def site_url(self, url):
+        if self.site and url.startswith(self.origin):
+            return self.site + url[len(self.origin):]
+        return url
+
+    def semaphore(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.concurrency)
+        return self.semaphores[host]
+
+    def scrape(self, items):
+        # Runs the whole scrape, returns the 2xx results like get_results()
+        started = time.time()
+        results = asyncio.run(self.scrape_items(items))
+        logger.info("Scraped %d pages in %.1fs: %s" % (len(self.visited), time.time() - started, self.stats))
+        return results
+
+    async def scrape_items(self, items):
+        queue = asyncio.Queue()
+        for item in items:
+            self.queue(queue, item)
+
+        # Fetches block in requests, so they go to threads; one per request
+        # that may be in flight at a time
+        # workers=0 parses in those threads instead of worker processes
+        parse_pool = process_pool(self.workers) if self.workers != 0 else nullcontext()
+        with ThreadPoolExecutor(self.concurrency * 2, thread_name_prefix="fetch") as fetch_pool, \
+                parse_pool as parse_pool:
+            workers = [asyncio.create_task(self.worker(queue, fetch_pool, parse_pool))
+                       for _ in range(self.concurrency * 2)]
+            # Workers only ever finish by failing (not logged in), which ends
+            # the whole scrape
+            joined = asyncio.create_task(queue.join())
+            (done, pending) = await asyncio.wait(workers + [joined], return_when=asyncio.FIRST_COMPLETED)
+            for task in workers + [joined]:
+                task.cancel()
+            await asyncio.gather(*workers, joined, return_exceptions=True)
+            for task in done:
+                if task is not joined:
+                    task.result()
+
+        return [item.get("results", None) for item in self.results
+                if item.get("code", 500) // 100 == 2]
+
+    def queue(self, queue, item):
+        url = item.get("url", None)
+        if not url or url in self.visited:
+            return
+        self.visited.add(url)
+        if self.skip and self.skip(item):
+            self.stats["skipped"] += 1
+            return
+        logger.debug("Queuing item: %s" % url)
+        queue.put_nowait(item)
+
+    async def worker(self, queue, fetch_pool, parse_pool):
+        while True:
+            item = await queue.get()
+            try:
+                await self.process(queue, item, fetch_pool, parse_pool)
+            except LoginFailed:
+                raise
+            except Exception:
+                self.stats["errors"] += 1
+                logger.exception("Failed on %s" % item.get("url", None))
+            finally:
+                queue.task_done()
+
+    async def process(self, queue, item, fetch_pool, parse_pool):
+        cache_item = await self.fetch(item, fetch_pool)
+        if cache_item is None:
+            return
+
+        type_ = item.get("type", None)
+        callback = self.callbacks.get(type_, None)
+        if callback is None:
+            callback_response = {
+                "results": cache_item,
+            }
+        else:
+            callback_response = self.parse_cache.get(type_, cache_item) if self.parse_cache else None
+            if callback_response is None:
+                loop = asyncio.get_running_loop()
+                if parse_pool is None:
+                    callback_response = await loop.run_in_executor(fetch_pool, callback, cache_item)
+                else:
+                    (callback_response, snapshot) = await loop.run_in_executor(parse_pool, measured, callback,
+                                                                               cache_item)
+                    metrics.merge(snapshot)
+                if self.parse_cache:
+                    self.parse_cache.put(type_, cache_item, callback_response)
+
+        if not callback_response:
+            callback_response = {}
+
+        for chain_item in callback_response.get("chain", []):
+            self.queue(queue, chain_item)
+
+        results = callback_response.get("results", None)
+        if results:
+            self.results.append({
+                "url": item.get("url"),
+                "type": type_,
+                "code": cache_item.get("code", None),
+                "results": results,
+            })
+
+    async def fetch(self, item, fetch_pool):
+        url = item.get("url")
+        headers = dict(item.get("headers", None) or {})
+
+        cached = self.cache.lookup(url) if self.cache else None
+        if cached and cached["fresh"]:
+            self.stats["cached"] += 1
+            return cached
+
+        if cached:
+            # Only fetch it again if it has changed
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last-modified"]:
+                headers["If-Modified-Since"] = cached["last-modified"]
+
+        loop = asyncio.get_running_loop()
+        request = partial(self.session.request, "GET", self.site_url(url), headers=headers, timeout=self.timeout)
+        async with self.semaphore(url):
+            await asyncio.sleep(random.uniform(self.min_delay, self.max_delay))
+            logger.info("GET/%s" % url)
+            self.stats["requests"] += 1
+            try:
+                response = await loop.run_in_executor(fetch_pool, request)
+            except requests.RequestException as e:
+                logger.warning("Request for %s failed: %s" % (url, e))
+                self.stats["errors"] += 1
+                return None
+        self.check_login(url, response)
+
+        if response.status_code == 304 and cached:
+            self.stats["revalidated"] += 1
+            self.cache.refresh(url)
+            cached["ctime"] = time.time()
+            return cached
+
+        if self.cache and response.status_code // 100 == 2:
+            self.cache.put(url, response.status_code, response.content, etag=response.headers.get("ETag", None),
+                           last_modified=response.headers.get("Last-Modified", None))
+        return {
+            "code": response.status_code,
+            "url": url,
+            "body": response.content.decode("utf-8"),
+            "ctime": time.time(),
+        }
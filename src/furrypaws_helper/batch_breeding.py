@@ -0,0 +1,193 @@
+import heapq
+import logging
+from collections import Counter
+
+import numpy as np
+
+from furrypaws_helper.compact_genotype import CompactGenotype
+from furrypaws_helper.exceptions import BadGenotype
+from furrypaws_helper.genetics_base import BaseGenetics
+from furrypaws_helper.genetics_coat import CoatColorGenetics
+from furrypaws_helper.genetics_health import HealthGenetics
+from furrypaws_helper.genotype import get_genotype
+
+logger = logging.getLogger(__name__)
+
+
+class BatchBreeder(object):
+    # Works out every stud x bitch pairing of a breed in one go on integer
+    # allele arrays, giving the same numbers as PotentialLitter.breed()
+    max_alleles = max(len(alleles) for alleles in BaseGenetics.possible_alleles)
+    health_start = 17
+    health_end = 41
+    block_size = 6
+    rating_names = np.array([rating for (rating, min_count) in reversed(HealthGenetics.threshholds)])
+    rating_minimums = np.array([min_count for (rating, min_count) in reversed(HealthGenetics.threshholds)])
+
+    # Filled in below the class: for each locus, offspring code -> genome
+    # string spelled the way breed() does
+    genome_keys = []
+
+    def __init__(self, studs, bitches, coat_floor=CoatColorGenetics.phenotype_floor):
+        # coat_floor: see CoatColorGenetics.litter_phenotypes(); None leaves
+        # the coat colors out of the litters altogether
+        self.studs = studs
+        self.bitches = bitches
+        self.coat_floor = coat_floor
+        self.stud_loci = self.encode(studs)
+        self.bitch_loci = self.encode(bitches)
+
+        # Health loci only come in H/h, so each pup locus is worked out from
+        # how many h alleles each parent carries there:
+        #   expected defect alleles = (stud h + bitch h) / 4
+        #   expected hh (percent)   = 25 * stud h * bitch h
+        h_index = BaseGenetics.possible_alleles[self.health_start].index("h")
+        self.stud_h = (self.stud_loci[:, self.health_start:self.health_end, :] == h_index).sum(axis=2)
+        self.bitch_h = (self.bitch_loci[:, self.health_start:self.health_end, :] == h_index).sum(axis=2)
+
+        # All of the (bitches, studs) totals come out of per-dog sums and a
+        # handful of small matrix products, without building per-locus arrays
+        self.total_defects = (self.bitch_h.sum(axis=1)[:, None] + self.stud_h.sum(axis=1)[None, :]) / 4.0
+
+        block_hhs = []
+        for start in range(0, self.health_end - self.health_start, self.block_size):
+            bitch_block = self.bitch_h[:, start:start + self.block_size].astype(np.float64)
+            stud_block = self.stud_h[:, start:start + self.block_size].astype(np.float64)
+            block_hhs.append(25 * np.rint(bitch_block @ stud_block.T).astype(np.int64))
+        # (bitches, studs, 4) expected hh percentages per rating block
+        self.block_hhs = np.stack(block_hhs, axis=2)
+        self.total_hhs = self.block_hhs.sum(axis=2) / 100.0
+        self.rating_indexes = np.searchsorted(self.rating_minimums, self.block_hhs / 100.0, side="right") - 1
+
+    @staticmethod
+    def encode(dogs):
+        loci = np.zeros((len(dogs), CompactGenotype.locus_count, 2), dtype=np.uint8)
+        for (index, dog) in enumerate(dogs):
+            text = dog.get("genotype", "")
+            if not text:
+                raise BadGenotype("No genotype for %s" % dog.get("name", None))
+            compact = get_genotype(text).compact
+            loci[index] = np.frombuffer(compact.loci, dtype=np.uint8).reshape(-1, 2)
+        return loci
+
+    def offspring_codes(self, bitches=None, studs=None):
+        # (bitches, studs, 41, 4): the four equally likely pup genomes of every
+        # locus, each as lo * max_alleles + hi of the two allele indexes.
+        # Defaults to every pairing, or give lists of bitch/stud indexes.
+        bitch_loci = self.bitch_loci if bitches is None else self.bitch_loci[bitches]
+        stud_loci = self.stud_loci if studs is None else self.stud_loci[studs]
+        dad = stud_loci[None, :, :, :, None]
+        mom = bitch_loci[:, None, :, None, :]
+        codes = np.minimum(dad, mom) * self.max_alleles + np.maximum(dad, mom)
+        return codes.reshape(len(bitch_loci), len(stud_loci), CompactGenotype.locus_count, 4)
+
+    @classmethod
+    def build_genome_keys(cls):
+        tables = []
+        for alleles in BaseGenetics.possible_alleles:
+            table = {}
+            for lo in range(len(alleles)):
+                for hi in range(lo, len(alleles)):
+                    table[lo * cls.max_alleles + hi] = "".join(sorted([alleles[lo], alleles[hi]]))
+            tables.append(table)
+        return tables
+
+    def rating_odds(self, bitches=None):
+        # Exact rating chances, see HealthGenetics.rating_odds().  Gives
+        # (bitches, studs, block, rating) odds with ratings in rating_names
+        # order, and the (bitches, studs) chance of an all-Excellent pup.
+        bitch_h = self.bitch_h if bitches is None else self.bitch_h[bitches]
+        chances = bitch_h[:, None, :] * self.stud_h[None, :, :] / 4.0
+        chances = chances.reshape(len(bitch_h), len(self.studs), -1, self.block_size)
+
+        counts = np.zeros(chances.shape[:3] + (self.block_size + 1,))
+        counts[..., 0] = 1.0
+        for locus in range(self.block_size):
+            chance = chances[..., locus, None]
+            shifted = counts[..., :-1] * chance
+            counts = counts * (1.0 - chance)
+            counts[..., 1:] += shifted
+
+        odds = np.zeros(counts.shape[:3] + (len(self.rating_names),))
+        rating_indexes = np.searchsorted(self.rating_minimums, np.arange(self.block_size + 1), side="right") - 1
+        for (defects, rating) in enumerate(rating_indexes):
+            odds[..., rating] += counts[..., defects]
+
+        excellent = np.ones(odds.shape[:2])
+        for block in range(odds.shape[2]):
+            excellent = excellent * odds[..., block, 0]
+
+        return odds, excellent
+
+    def expected_defects(self, bitch, stud):
+        return (self.bitch_h[bitch] + self.stud_h[stud]) / 4.0
+
+    def expected_hhs(self, bitch, stud):
+        return 25 * self.bitch_h[bitch] * self.stud_h[stud]
+
+    def ratings(self, bitch, stud):
+        return "".join(self.rating_names[self.rating_indexes[bitch, stud]])
+
+    def pup_genomes(self, bitch, stud, codes=None):
+        if codes is None:
+            codes = self.offspring_codes([bitch], [stud])[0, 0]
+        codes = codes.tolist()
+        return [{self.genome_keys[index][code]: 25 * count for (code, count) in Counter(locus).items()}
+                for (index, locus) in enumerate(codes)]
+
+    def ranked_studs(self, bitch, rank="defects", top=None):
+        # Stud indexes for a bitch, best first, worked out from the score
+        # arrays alone so that only the studs that make the cut have to go
+        # through litter().  Ties keep stud order, as sorted() would.
+        defects = self.total_defects[bitch].tolist()
+        if rank == "excellent":
+            excellent = self.rating_odds([bitch])[1][0].tolist()
+            keys = [(-chance, defect) for (chance, defect) in zip(excellent, defects)]
+        else:
+            keys = defects
+
+        studs = range(len(self.studs))
+        if top:
+            # Bounded heap, no need to sort the lot
+            return heapq.nsmallest(top, studs, key=keys.__getitem__)
+        return sorted(studs, key=keys.__getitem__)
+
+    def litter(self, bitch, stud, codes=None, odds=None, excellent=None):
+        if codes is None:
+            codes = self.offspring_codes([bitch], [stud])[0, 0]
+        if odds is None or excellent is None:
+            (odds, excellent) = self.rating_odds([bitch])
+            (odds, excellent) = (odds[0], excellent[0])
+        health_odds = {block: dict(zip(self.rating_names.tolist(), ratings))
+                       for (block, ratings) in zip(HealthGenetics.blocks, odds[stud].tolist())}
+
+        dad = get_genotype(self.studs[stud].get("genotype", ""))
+        mom = get_genotype(self.bitches[bitch].get("genotype", ""))
+        litter = {
+            "stud": self.studs[stud].get("name"),
+            "bitch": self.bitches[bitch].get("name"),
+            "size-genome": "".join(sorted(mom.alleles[14])),
+            "litter-size": mom.summary.get("litter-size", "Unknown"),
+            "genomes": self.pup_genomes(bitch, stud, codes),
+            "defects-map": self.expected_defects(bitch, stud).tolist(),
+            "avg-total-defect-alleles": float(self.total_defects[bitch, stud]),
+            "avg-health-score": self.ratings(bitch, stud),
+            'total-defect-expected': float(self.total_hhs[bitch, stud]),
+            "health-odds": health_odds,
+            "excellent-odds": float(excellent[stud]),
+        }
+        if self.coat_floor is not None:
+            litter["coat-colors"] = CoatColorGenetics.litter_phenotypes(dad.alleles, mom.alleles, self.coat_floor)
+        return litter
+
+    def litters(self, bitch, studs=None):
+        # Litters of one bitch with the given stud indexes (default: all of them)
+        if studs is None:
+            studs = list(range(len(self.studs)))
+        codes = self.offspring_codes([bitch], studs)[0]
+        (odds, excellent) = self.rating_odds([bitch])
+        return [self.litter(bitch, stud, codes[index], odds[0], excellent[0])
+                for (index, stud) in enumerate(studs)]
+
+
+BatchBreeder.genome_keys = BatchBreeder.build_genome_keys()
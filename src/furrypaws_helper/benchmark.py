@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from furrypaws_helper import setup_logging
+from furrypaws_helper.genetics_base import BaseGenetics
+from furrypaws_helper.genetics_coat import CoatColorGenetics
+from furrypaws_helper.genetics_eye import EyeColorGenetics
+from furrypaws_helper.genetics_health import HealthGenetics
+from furrypaws_helper.genetics_litter import LitterSizeGenetics
+from furrypaws_helper.genetics_stats import StatBoostGenetics
+from furrypaws_helper.genotype import Genotype, genotype_cache, get_genotype
+from furrypaws_helper.potential_litter import PotentialLitter, breed_litters, process_file
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the benchmarks change enough that older results don't compare
+results_version = 1
+
+traits = {
+    "eye-color": EyeColorGenetics,
+    "coat-color": CoatColorGenetics,
+    "litter-size": LitterSizeGenetics,
+    "stat-boost": StatBoostGenetics,
+    "health": HealthGenetics,
+}
+
+
+def random_genotype(rng):
+    # Two random alleles per locus, spelled the way the site does: in
+    # possible_alleles order, e.g. "Pp" or "atasa"
+    genomes = []
+    for alleles in BaseGenetics.possible_alleles:
+        pair = sorted([rng.randrange(len(alleles)), rng.randrange(len(alleles))])
+        genomes.append("".join(alleles[index] for index in pair))
+    return " ".join(genomes)
+
+
+def random_kennel(rng, size, breeds=5, female_ratio=0.5, breedable_ratio=0.8):
+    # A kennel list shaped like the one scrape_kennel writes, with just the
+    # fields the pairing reads
+    kennel = []
+    for index in range(size):
+        dog_id = 1000000 + index
+        kennel.append({
+            "id": dog_id,
+            "name": "Dog %d" % dog_id,
+            "breed": "Breed %d" % rng.randrange(breeds),
+            "sex": "Female" if rng.random() < female_ratio else "Male",
+            "age": rng.randint(12, 110),
+            "breedable": rng.random() < breedable_ratio,
+            "genotype": random_genotype(rng),
+        })
+    return kennel
+
+
+def write_kennel(filename, kennel):
+    with open(filename, "w") as f:
+        json.dump(kennel, f, indent=2, sort_keys=True)
+
+
+class Benchmark(object):
+    # Times each case a few times over and keeps the best and mean run, so
+    # results can be compared across commits
+    def __init__(self, repeat=3):
+        self.repeat = repeat
+        self.results = []
+
+    def run(self, name, function, items=1, setup=None, **params):
+        times = []
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+
+        best = min(times)
+        result = {
+            "name": name,
+            "params": params,
+            "items": items,
+            "repeat": self.repeat,
+            "best": best,
+            "mean": sum(times) / len(times),
+            "per-item": best / items if items else None,
+        }
+        logger.info("%s %s: best %.4fs, %.2fus per item" % (name, params, best, 1e6 * result["per-item"]))
+        self.results.append(result)
+        return result
+
+
+def git_commit():
+    try:
+        output = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_genotypes(benchmark, rng, count):
+    texts = [random_genotype(rng) for _ in range(count)]
+    split = [text.split() for text in texts]
+    alleles = [BaseGenetics.split_genomes(genomes) for genomes in split]
+
+    benchmark.run("split-genomes", lambda: [BaseGenetics.split_genomes(genomes) for genomes in split],
+                  items=count, count=count)
+    benchmark.run("genotype", lambda: [Genotype(text) for text in texts], items=count, count=count)
+    for (trait, cls) in sorted(traits.items()):
+        benchmark.run("summarize", lambda cls=cls: [cls(genomes, pairs) for (genomes, pairs) in zip(split, alleles)],
+                      items=count, count=count, trait=trait)
+
+
+def run_breeding(benchmark, rng, count):
+    studs = [{"name": "Stud %d" % index, "genotype": random_genotype(rng)} for index in range(count)]
+    bitches = [{"name": "Bitch %d" % index, "genotype": random_genotype(rng)} for index in range(count)]
+    pairs = count * count
+
+    # Parsing is measured above, so have the genotypes cached already
+    for dog in studs + bitches:
+        get_genotype(dog["genotype"])
+    benchmark.run("breed", lambda: [PotentialLitter(stud, bitch) for bitch in bitches for stud in studs],
+                  items=pairs, studs=count, bitches=count)
+    benchmark.run("batch-breed", lambda: breed_litters(studs, bitches, "defects"), items=pairs,
+                  studs=count, bitches=count)
+
+
+def run_process_file(benchmark, seed, sizes, breeds, top, jobs, workdir):
+    for size in sizes:
+        kennel = random_kennel(random.Random(seed), size, breeds)
+        infile = os.path.join(workdir, "kennel-%d.json" % size)
+        write_kennel(infile, kennel)
+        outfile = os.path.join(workdir, "litters-%d=%%s.json" % size)
+        pairs = 0
+        for breed in {dog["breed"] for dog in kennel}:
+            dogs = [dog for dog in kennel if dog["breed"] == breed and dog["breedable"]]
+            pairs += sum(dog["sex"] == "Female" for dog in dogs) * sum(dog["sex"] == "Male" for dog in dogs)
+
+        benchmark.run("process-file", lambda: process_file(infile, outfile, jobs=jobs, top=top),
+                      setup=genotype_cache.clear, items=max(pairs, 1),
+                      dogs=size, breeds=breeds, pairs=pairs, top=top, jobs=jobs)
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark genotype parsing, summaries and pairing on a synthetic kennel")
+    parser.add_argument("-d", "--debug", action="store_true", help="Turn on debug output")
+    parser.add_argument("-o", "--output-file", action="store", default="benchmark.json",
+                        help="Results file (default: %(default)s)")
+    parser.add_argument("--seed", action="store", type=int, default=1, help="Random seed (default: %(default)s)")
+    parser.add_argument("-r", "--repeat", action="store", type=int, default=3,
+                        help="Runs of each case, the best one counts (default: %(default)s)")
+    parser.add_argument("-n", "--genotypes", action="store", type=int, default=2000,
+                        help="Genotypes to parse and summarize (default: %(default)s)")
+    parser.add_argument("-p", "--pairs", action="store", type=int, default=40,
+                        help="Studs and bitches to breed against each other (default: %(default)s)")
+    parser.add_argument("-s", "--sizes", action="store", default="100,1000",
+                        help="Kennel sizes to run process_file on, comma separated (default: %(default)s)")
+    parser.add_argument("-b", "--breeds", action="store", type=int, default=5,
+                        help="Breeds in the synthetic kennels (default: %(default)s)")
+    parser.add_argument("-t", "--top", action="store", type=int, default=None,
+                        help="Keep only the best TOP studs per bitch in process_file (default: all of them)")
+    parser.add_argument("-j", "--jobs", action="store", type=int, default=1,
+                        help="Worker processes for process_file (default: %(default)s)")
+    parser.add_argument("-g", "--generate", action="store", default=None, metavar="FILE",
+                        help="Just write a synthetic kennel list of the first size to FILE")
+    args = parser.parse_args()
+
+    level = logging.INFO
+    if args.debug:
+        level = logging.DEBUG
+    setup_logging(level)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    if args.generate:
+        logger.info("Writing a kennel of %d dogs to %s" % (sizes[0], args.generate))
+        write_kennel(args.generate, random_kennel(random.Random(args.seed), sizes[0], args.breeds))
+        return
+
+    benchmark = Benchmark(args.repeat)
+    rng = random.Random(args.seed)
+    run_genotypes(benchmark, rng, args.genotypes)
+    run_breeding(benchmark, rng, args.pairs)
+
+    # process_file is chatty at INFO, one line per bitch
+    logging.getLogger("furrypaws_helper.potential_litter").setLevel(max(level, logging.WARNING))
+    with tempfile.TemporaryDirectory() as workdir:
+        run_process_file(benchmark, args.seed, sizes, args.breeds, args.top, args.jobs, workdir)
+
+    results = {
+        "version": results_version,
+        "created": time.time(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+        "benchmarks": benchmark.results,
+    }
+    logger.info("Saving results to %s" % args.output_file)
+    with open(args.output_file, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+import json
+import logging
+import sys
+import time
+from argparse import ArgumentParser
+from collections import defaultdict
+from functools import lru_cache
+
+from furrypaws_helper import setup_logging
+from furrypaws_helper.genetics_base import BaseGenetics
+from furrypaws_helper.genotype import genotype_hash, get_genotype
+from furrypaws_helper.kennel_store import KennelStore
+from furrypaws_helper.potential_litter import load_kennel
+
+logger = logging.getLogger(__name__)
+
+health_start = 17
+health_end = 41
+
+
+# A dog, real or hypothetical, is a tuple of 41 loci, each a sorted tuple of
+# (allele pair, chance) for the genomes it may have.  A kennel dog has one
+# pair per locus at chance 1.  Loci are inherited independently, so the
+# loci of a pup of two such dogs are just the per locus offspring odds.
+
+def dog_loci(dog):
+    alleles = get_genotype(dog.get("genotype", "")).alleles
+    return tuple(((tuple(pair), 1.0),) for pair in alleles)
+
+
+@lru_cache(maxsize=None)
+def offspring_locus(dad_locus, mom_locus):
+    # Memoized per locus: the same pairs of locus odds come up over and over
+    # again in the search, even though whole dogs hardly ever repeat
+    odds = defaultdict(float)
+    for (dad_pair, dad_chance) in dad_locus:
+        for (mom_pair, mom_chance) in mom_locus:
+            chance = dad_chance * mom_chance / 4.0
+            for dad in dad_pair:
+                for mom in mom_pair:
+                    odds[tuple(sorted([dad, mom]))] += chance
+    return tuple(sorted(odds.items()))
+
+
+def breed_loci(dad_loci, mom_loci):
+    return tuple(offspring_locus(dad, mom) for (dad, mom) in zip(dad_loci, mom_loci))
+
+
+@lru_cache(maxsize=65536)
+def health_scores(loci):
+    # Expected defect alleles, as in avg-total-defect-alleles, and the chance
+    # that every health block rates Excellent (no hh at all)
+    defects = 0.0
+    excellent = 1.0
+    for locus in loci[health_start:health_end]:
+        defects += sum(pair.count("h") * chance for (pair, chance) in locus) / 2.0
+        excellent *= 1.0 - sum(chance for (pair, chance) in locus if pair == ("h", "h"))
+    return defects, excellent
+
+
+def target_odds(loci, targets):
+    # Chance of hitting every target genome
+    odds = 1.0
+    for (index, pairs) in targets.items():
+        odds *= sum(chance for (pair, chance) in loci[index] if pair in pairs)
+    return odds
+
+
+def parse_targets(texts):
+    # "11:cc" or "4:dd,Dd" -> {locus index: {allele pairs}}
+    targets = {}
+    for text in texts or []:
+        (index, genomes) = text.split(":", 1)
+        index = int(index)
+        if not 0 <= index < len(BaseGenetics.possible_alleles):
+            raise ValueError("No locus %d" % index)
+        pairs = set()
+        for genome in genomes.split(","):
+            pair = BaseGenetics.genome_tokens[index].get(genome.strip(), None)
+            if pair is None:
+                raise ValueError("%s is not a genome of locus %d" % (genome, index))
+            pairs.add(tuple(pair))
+        targets.setdefault(index, set()).update(pairs)
+    return targets
+
+
+def genome_odds(loci):
+    # Same shape as the "genomes" of a litter: percent of each genome per locus
+    return [{"".join(pair): 100.0 * chance for (pair, chance) in locus} for locus in loci]
+
+
+class BreedingPlanner(object):
+    # Beam search over sequences of pairings: kennel stud x kennel bitch,
+    # then the (hypothetical) pup x a kennel dog of the other sex, and so on
+    # for the given number of generations.  Only the width best plans of
+    # each generation are taken on to the next.
+    ranks = ["defects", "excellent"]
+
+    def __init__(self, dogs, rank="defects", targets=None, width=50, target_weight=10.0):
+        # dogs: breed -> sex -> breedable dogs, as from bucket_dogs()
+        self.dogs = dogs
+        self.rank = rank
+        self.targets = targets or {}
+        self.width = width
+        self.target_weight = target_weight
+        self.loci = {}
+        self.evaluations = 0
+
+    def get_loci(self, dog):
+        # Dogs with the same genotype share their loci
+        key = genotype_hash(dog.get("genotype", ""))
+        if key not in self.loci:
+            self.loci[key] = dog_loci(dog)
+        return self.loci[key]
+
+    def score(self, loci):
+        # Lower is better
+        (defects, excellent) = health_scores(loci)
+        hit = target_odds(loci, self.targets)
+        if self.rank == "excellent":
+            return -excellent * hit
+        return defects + self.target_weight * (1.0 - hit)
+
+    def plan(self, loci, breed, steps):
+        (defects, excellent) = health_scores(loci)
+        return {
+            "breed": breed,
+            "steps": steps,
+            "loci": loci,
+            "score": self.score(loci),
+            "expected-defects": defects,
+            "excellent-odds": excellent,
+            "target-odds": target_odds(loci, self.targets),
+        }
+
+    def pair(self, dad_loci, mom_loci):
+        self.evaluations += 1
+        return breed_loci(dad_loci, mom_loci)
+
+    def best(self, plans):
+        # The width best plans, one per distinct pup
+        seen = set()
+        kept = []
+        for plan in sorted(plans, key=lambda x: x["score"]):
+            if plan["loci"] in seen:
+                continue
+            seen.add(plan["loci"])
+            kept.append(plan)
+            if len(kept) >= self.width:
+                break
+        return kept
+
+    def first_generation(self, breed):
+        plans = []
+        for stud in self.dogs[breed].get("Male", []):
+            for bitch in self.dogs[breed].get("Female", []):
+                loci = self.pair(self.get_loci(stud), self.get_loci(bitch))
+                plans.append(self.plan(loci, breed, [{"stud": stud.get("name"), "bitch": bitch.get("name")}]))
+        return self.best(plans)
+
+    def next_generation(self, beam):
+        plans = []
+        for plan in beam:
+            pup = "pup %d" % len(plan["steps"])
+            breed = plan["breed"]
+            for stud in self.dogs[breed].get("Male", []):
+                loci = self.pair(self.get_loci(stud), plan["loci"])
+                plans.append(self.plan(loci, breed, plan["steps"] + [{"stud": stud.get("name"), "bitch": pup}]))
+            for bitch in self.dogs[breed].get("Female", []):
+                loci = self.pair(plan["loci"], self.get_loci(bitch))
+                plans.append(self.plan(loci, breed, plan["steps"] + [{"stud": pup, "bitch": bitch.get("name")}]))
+        return self.best(plans)
+
+    def search(self, generations=2, breeds=None):
+        # Best plans of each generation, each list best first
+        if breeds is None:
+            breeds = sorted(self.dogs.keys())
+
+        beam = []
+        for breed in breeds:
+            if breed in self.dogs:
+                beam.extend(self.first_generation(breed))
+        beam = self.best(beam)
+        results = [beam]
+
+        for generation in range(2, generations + 1):
+            start = time.perf_counter()
+            beam = self.next_generation(beam)
+            logger.info("Generation %d: %d plans, best score %s, %.2fs" %
+                        (generation, len(beam), beam[0]["score"] if beam else None, time.perf_counter() - start))
+            results.append(beam)
+        logger.info("%d pairs evaluated, loci: %s" % (self.evaluations, offspring_locus.cache_info()))
+        return results
+
+    @staticmethod
+    def describe(plan):
+        result = {key: value for (key, value) in plan.items() if key != "loci"}
+        result["genomes"] = genome_odds(plan["loci"])
+        return result
+
+
+def main():
+    parser = ArgumentParser(description="Plan pairings a few generations out")
+    parser.add_argument("-d", "--debug", action="store_true", help="Turn on debug output")
+    parser.add_argument("-i", "--input-file", action="store", help="Input file", default="kennel-list.json")
+    parser.add_argument("-s", "--store", action="store", default=None,
+                        help="Kennel store to read the dogs from instead of the input file")
+    parser.add_argument("-o", "--output-file", action="store", default="plans.json", help="Output file")
+    parser.add_argument("-b", "--breed", action="append", dest="breeds", default=None,
+                        help="Only plan for this breed, may be repeated (default: every breed)")
+    parser.add_argument("-g", "--generations", action="store", type=int, default=2,
+                        help="Generations of pairings to plan (default: %(default)s)")
+    parser.add_argument("-w", "--width", action="store", type=int, default=50,
+                        help="Plans kept from each generation for the next (default: %(default)s)")
+    parser.add_argument("-n", "--plans", action="store", type=int, default=10,
+                        help="Plans to write out per generation (default: %(default)s)")
+    parser.add_argument("-r", "--rank", action="store", choices=BreedingPlanner.ranks, default="defects",
+                        help="Aim for the fewest expected defect alleles or the best chance of an all-Excellent "
+                             "pup (%(choices)s - default: %(default)s)")
+    parser.add_argument("-t", "--target", action="append", dest="targets", default=None,
+                        help="Genome(s) to aim for at a locus, e.g. 11:cc or 4:dd,Dd.  May be repeated")
+    parser.add_argument("--target-weight", action="store", type=float, default=10.0,
+                        help="With -r defects, defect alleles a missed target costs (default: %(default)s)")
+    args = parser.parse_args()
+
+    level = logging.INFO
+    if args.debug:
+        level = logging.DEBUG
+    setup_logging(level)
+
+    if args.store:
+        store = KennelStore(args.store)
+        dogs = store.breeding_dogs()
+        store.close()
+    else:
+        dogs = load_kennel(args.input_file)
+
+    try:
+        targets = parse_targets(args.targets)
+    except ValueError as e:
+        parser.error(str(e))
+
+    planner = BreedingPlanner(dogs, args.rank, targets, args.width, args.target_weight)
+    start = time.perf_counter()
+    generations = planner.search(args.generations, args.breeds)
+    logger.info("Planned in %.2fs" % (time.perf_counter() - start))
+
+    results = [{"generation": index + 1, "plans": [planner.describe(plan) for plan in beam[:args.plans]]}
+               for (index, beam) in enumerate(generations)]
+    logger.info("Saving plans to %s" % args.output_file)
+    with open(args.output_file, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
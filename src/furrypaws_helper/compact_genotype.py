@@ -0,0 +1,97 @@
+import logging
+
+from furrypaws_helper.exceptions import BadGenotype, BadGenome
+from furrypaws_helper.genetics_base import BaseGenetics
+
+logger = logging.getLogger(__name__)
+
+
+class CompactGenotype(object):
+    # Two bytes per locus, each an index into BaseGenetics.possible_alleles[locus].
+    # The alleles are kept in the order they appear in the genotype text so that
+    # to_text() gives back exactly what was parsed.  Immutable, so that one can
+    # be shared (e.g. through the genotype cache).
+    __slots__ = ("loci",)
+
+    locus_count = len(BaseGenetics.possible_alleles)
+    allele_indexes = [{allele: index for (index, allele) in enumerate(alleles)}
+                      for alleles in BaseGenetics.possible_alleles]
+    token_indexes = [{first + second: (i, j) for (i, first) in enumerate(alleles) for (j, second) in enumerate(alleles)}
+                     for alleles in BaseGenetics.possible_alleles]
+
+    def __init__(self, loci):
+        loci = bytes(loci)
+        if len(loci) != 2 * self.locus_count:
+            raise BadGenotype("Genotypes must have %d genomes, not %d" % (self.locus_count, len(loci) // 2))
+        for (index, alleles) in enumerate(BaseGenetics.possible_alleles):
+            if loci[2 * index] >= len(alleles) or loci[2 * index + 1] >= len(alleles):
+                raise BadGenome("Bad genome: Index %d has an unknown allele" % index)
+        object.__setattr__(self, "loci", loci)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompactGenotype cannot be changed")
+
+    @classmethod
+    def from_text(cls, text):
+        genomes = str(text).split()
+        if len(genomes) != cls.locus_count:
+            raise BadGenotype("Genotypes must have %d genomes, not %d" % (cls.locus_count, len(genomes)))
+
+        loci = bytearray()
+        for (index, genome) in enumerate(genomes):
+            pair = cls.token_indexes[index].get(genome, None)
+            if pair is None:
+                # Gives the usual complaint for unrecognized alleles
+                BaseGenetics.scan_genome(index, genome)
+                raise BadGenome("Bad genome: Index %d (%s) is not a pair of alleles" % (index, genome))
+            loci.extend(pair)
+        return cls(loci)
+
+    @classmethod
+    def from_alleles(cls, alleles):
+        if len(alleles) != cls.locus_count:
+            raise BadGenotype("Genotypes must have %d genomes, not %d" % (cls.locus_count, len(alleles)))
+
+        loci = bytearray()
+        for (index, pair) in enumerate(alleles):
+            indexes = cls.allele_indexes[index]
+            try:
+                loci.extend([indexes[allele] for allele in pair])
+            except KeyError:
+                raise BadGenome("Bad genome: Index %d (%s) has unknown alleles" % (index, "".join(pair)))
+        return cls(loci)
+
+    def pair(self, index):
+        return self.loci[2 * index], self.loci[2 * index + 1]
+
+    def genome_list(self):
+        loci = self.loci
+        return [alleles[loci[2 * index]] + alleles[loci[2 * index + 1]]
+                for (index, alleles) in enumerate(BaseGenetics.possible_alleles)]
+
+    def to_text(self):
+        return " ".join(self.genome_list())
+
+    @property
+    def alleles(self):
+        # Same shape as BaseGenetics.split_genomes(): sorted allele pairs
+        loci = self.loci
+        return [sorted([alleles[loci[2 * index]], alleles[loci[2 * index + 1]]])
+                for (index, alleles) in enumerate(BaseGenetics.possible_alleles)]
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactGenotype):
+            return NotImplemented
+        return self.loci == other.loci
+
+    def __hash__(self):
+        return hash(self.loci)
+
+    def __getstate__(self):
+        return self.loci
+
+    def __setstate__(self, state):
+        object.__setattr__(self, "loci", state)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.to_text())
@@ -21,9 +21,34 @@ class FurryConfig(object):
         cachedir = self.get("cache-dir", "~/.furrypaws/cache")
         return os.path.expanduser(cachedir)
 
+    def cache_backend(self):
+        # "files": a file per page (laracna's own cache), or "segment": all
+        # of the pages packed into one file, see SegmentCache
+        return self.get("cache-backend", "files")
+
+    def parse_cache(self):
+        filename = self.get("parse-cache", os.path.join(self.cachedir(), "parsed.db"))
+        return os.path.expanduser(filename)
+
     def expiry(self):
         return int(self.get("cache-expiry", 86400))
 
+    def kennels(self):
+        # Kennel ids to scrape, comma or space separated
+        kennels = self.get("kennels", "1621357")
+        return [kennel for kennel in kennels.replace(",", " ").split() if kennel]
+
+    def kennel_list(self):
+        return os.path.expanduser(self.get("kennel-list", "kennel-list.json"))
+
+    def concurrency(self):
+        # Requests the async scraper keeps in flight per host
+        return int(self.get("concurrency", 4))
+
+    def delta_max_age(self):
+        # Days a delta scrape may carry a dog forward before fetching it again
+        return int(self.get("delta-max-age", 7))
+
     def get(self, key, fallback=None):
         return self.config.get("furrypaws", key, fallback=fallback)
 
@@ -8,4 +8,16 @@ class BadGenotype(RuntimeError):
 
 
 class BadGenome(RuntimeError):
-    pass
\ No newline at end of file
+    pass
+
+
+class UnknownDog(RuntimeError):
+    pass
+
+
+class AmbiguousDog(RuntimeError):
+    pass
+
+
+class LoginFailed(RuntimeError):
+    pass
@@ -161,8 +161,12 @@ class BaseGenetics(object):
         ["H", "h"],  # 40 - Ear Rating
     ]
 
-    def __init__(self, genomes):
-        self.alleles = self.split_genomes(genomes)
+    def __init__(self, genomes, alleles=None):
+        # alleles may be handed in pre-split (see Genotype) so that several
+        # interpreters can share a single parse of the same genotype
+        if alleles is None:
+            alleles = self.split_genomes(genomes)
+        self.alleles = alleles
         self.genomes = ["".join(pair) for pair in self.alleles]
         self.summary = self.summarize()
 
@@ -172,21 +176,78 @@ class BaseGenetics(object):
     def summarize(self):
         raise NotImplementedError("summarize not implemented in %s" % self.__class__.__name__)
 
-    def split_genomes(self, genomes):
+    # Interpreters whose summary only depends on the most dominant allele
+    # present at some loci list the dominance order of those loci here
+    dominance = {}
+
+    # Filled in by build_class_tables(): for each locus in dominance, genome
+    # (as in self.genomes) -> allele class
+    class_tables = {}
+
+    @classmethod
+    def allele_class(cls, index, pair):
+        for allele in cls.dominance[index]:
+            if allele in pair:
+                return allele
+        return None
+
+    @classmethod
+    def build_class_tables(cls):
+        tables = {}
+        for index in cls.dominance:
+            alleles = cls.possible_alleles[index]
+            tables[index] = {"".join(sorted([first, second])): cls.allele_class(index, (first, second))
+                             for first in alleles for second in alleles}
+        return tables
+
+    @classmethod
+    def signature(cls, genomes):
+        return tuple(cls.class_tables[index][genomes[index]] for index in cls.dominance)
+
+    # Filled in below the class: for each locus, every valid genome token
+    # (e.g. "KbrKbr", "Kk", "atasa") mapped to its sorted allele pair
+    genome_tokens = []
+
+    @classmethod
+    def split_genomes(cls, genomes):
         pairs = []
         for (index, genome) in enumerate(genomes):
-            orig_genome = str(genome)
-            genome = str(genome)
-            pair = []
-            # print("index: %d, genome: '%s'" % (index, genome))
-            for allele in self.possible_alleles[index]:
-                while allele in genome:
-                    pair.append(allele)
-                    genome = genome.replace(allele, "", 1)
-                    # print("index: %d  allele: %s, genome: '%s'" % (index, allele, genome))
-            # print("index: %d, pair: %s" % (index, pair))
-            if len(pair) != 2:
-                raise BadGenome(
-                    "Bad genome: Index %d (%s) has %d recognized alleles" % (index, orig_genome, len(pair)))
-            pairs.append(sorted(pair))
+            pair = cls.genome_tokens[index].get(genome, None)
+            if pair is None:
+                # Not a token we know of, take the slow road (which will most
+                # likely complain about it)
+                pair = cls.scan_genome(index, genome)
+            pairs.append(list(pair))
         return pairs
+
+    @classmethod
+    def scan_genome(cls, index, genome):
+        orig_genome = str(genome)
+        genome = str(genome)
+        pair = []
+        # print("index: %d, genome: '%s'" % (index, genome))
+        for allele in cls.possible_alleles[index]:
+            while allele in genome:
+                pair.append(allele)
+                genome = genome.replace(allele, "", 1)
+                # print("index: %d  allele: %s, genome: '%s'" % (index, allele, genome))
+        # print("index: %d, pair: %s" % (index, pair))
+        if len(pair) != 2:
+            raise BadGenome(
+                "Bad genome: Index %d (%s) has %d recognized alleles" % (index, orig_genome, len(pair)))
+        return tuple(sorted(pair))
+
+    @classmethod
+    def build_genome_tokens(cls):
+        tables = []
+        for (index, alleles) in enumerate(cls.possible_alleles):
+            table = {}
+            for first in alleles:
+                for second in alleles:
+                    token = first + second
+                    table[token] = cls.scan_genome(index, token)
+            tables.append(table)
+        return tables
+
+
+BaseGenetics.genome_tokens = BaseGenetics.build_genome_tokens()
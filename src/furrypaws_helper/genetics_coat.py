@@ -1,4 +1,7 @@
+import itertools
 import logging
+from collections import defaultdict
+from functools import lru_cache
 
 from furrypaws_helper.genetics_base import BaseGenetics
 
@@ -76,198 +79,280 @@ https://www.furry-paws.com/help/article/fp-color-genetics
 class CoatColorGenetics(BaseGenetics):
     type_ = "coat color"
 
-    def summarize(self):
-        summary = ""
-        try:
-            # Check for solid black
-            solid_black = "K" in self.alleles[1]
-
-            # Check for brindle
-            brindled = not solid_black and "Kbr" in self.alleles[1]
-
-            # Check for agouti
-            agouti = not solid_black and (brindled or self.genomes[1] == "kk")
+    # Least chance of a coat phenotype worth listing on its own for a litter,
+    # the rarer ones are lumped together as "Other"
+    phenotype_floor = 0.01
+
+    # The coat rules only ever ask for the most dominant allele present at each
+    # of loci 1-13, so a locus boils down to one of these classes.  "cw" only
+    # counts when homozygous (cwc acts as c), hence it sits below "c".
+    dominance = {
+        1: ["K", "Kbr", "k"],
+        2: ["Em", "E", "e"],
+        3: ["B", "b"],
+        4: ["D", "d"],
+        5: ["Sl", "sl"],
+        6: ["Ay", "aw", "at", "asa", "a"],
+        7: ["S", "si", "sp", "sw"],
+        8: ["M", "m"],
+        9: ["R", "r"],
+        10: ["T", "ts", "t"],
+        11: ["C", "cch", "ce", "c", "cw"],
+        12: ["G", "g"],
+        13: ["U", "u"],
+    }
+    agouti_names = {"Ay": "Sable", "aw": "Grizzle", "at": "Points", "asa": "Saddle"}
+    white_names = {"si": "Irish", "sp": "Piebald", "sw": "Extreme Piebald"}
+
+    # signature -> phenotype, filled in as dogs get summarized
+    phenotypes = {}
 
-            black_mask = agouti and "Em" in self.alleles[2]
-
-            non_solid_black = "E" in self.genomes[2] and not black_mask
-
-            red_based = self.genomes[2] == "ee"
-            if red_based:
-                solid_black = False
-                non_solid_black = False
+    def summarize(self):
+        signature = self.signature(self.genomes)
+        summary = self.phenotypes.get(signature, None)
+        if summary is None:
+            summary = self.describe(signature)
+            self.phenotypes[signature] = summary
+        return summary
+
+    @classmethod
+    def describe(cls, signature):
+        (c1, c2, c3, c4, c5, c6, c7, c8, c9, c10, c11, c12, c13) = signature
+        pattern = cls.pattern(c1, c2, c6)
+        colors = cls.colors(pattern, cls.pigment(c3, c4, c12, c8), c11)
+        return cls.phenotype(colors, cls.white(c7, c9, c10), c13, c5)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def pattern(c1, c2, c6):
+        # Check for solid black
+        solid_black = c1 == "K"
+
+        # Check for brindle
+        brindled = c1 == "Kbr"
+
+        # Check for agouti
+        agouti = not solid_black
+
+        black_mask = agouti and c2 == "Em"
+
+        non_solid_black = c2 != "e" and not black_mask
+
+        red_based = c2 == "e"
+        if red_based:
+            solid_black = False
+            non_solid_black = False
+            agouti = False
+
+        # Sable ("Ay"), Grizzle ("aw"), Points ("at"), Saddle ("asa"), Recessive Solid Black ("a")
+        if agouti:
+            if c6 == "a":
+                solid_black = True
+                brindled = False
+                black_mask = False
                 agouti = False
+            else:
+                agouti = CoatColorGenetics.agouti_names[c6]
 
-            # Sable ("Ay"), Grizzle ("aw"), Points ("at"), Saddle ("asa"), Recessive Solid Black ("a")
-            recessive_solid_black = False
-            if agouti:
-                if self.genomes[6] == "aa":
-                    solid_black = True
-                    brindled = False
-                    black_mask = False
-                    recessive_solid_black = True
-                    agouti = False
-                elif "Ay" in self.alleles[6]:
-                    agouti = "Sable"
-                elif "aw" in self.alleles[6]:
-                    agouti = "Grizzle"
-                elif "at" in self.alleles[6]:
-                    agouti = "Points"
-                elif "asa" in self.alleles[6]:
-                    agouti = "Saddle"
-                else:
-                    agouti = False
-
-            black_color = "Black"
-
-            if self.genomes[3] == "bb":
-                black_color = "Chocolate"
-
-            if self.genomes[4] == "dd":
-                if black_color == "Black":
-                    black_color = "Blue"
-                else:
-                    black_color = "Isabella"
+        return solid_black, brindled, agouti, black_mask, non_solid_black, red_based
 
-            mask_color = black_color
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def pigment(c3, c4, c12, c8):
+        black_color = "Black"
 
-            if "G" in self.alleles[12]:
-                if black_color == "Black":
-                    black_color = "Steel Blue"
-                elif black_color == "Chocolate":
-                    black_color = "Faded Brown"
-                elif black_color == "Blue":
-                    black_color = "Faded Blue"
-                else:
-                    black_color = "Faded Isabella"
+        if c3 == "b":
+            black_color = "Chocolate"
 
-            merled = "M" in self.alleles[8]
-            if merled and black_color == "Black":
+        if c4 == "d":
+            if black_color == "Black":
                 black_color = "Blue"
-
-            """
-            How about all those shades of red?
-            The shades of red are controlled by the "Color Intensity" (Pair #11) locus. "C" is the most dominant, causing 
-            the color "Red." "cch" is the next most dominant, causing the color "Fawn" on dogs, or "Tan" when occurring in 
-            the "Points" marking. "ce" is the next dominant, causing the color "Cream," and "cw" is the most recessive, 
-            causing "Silver" only when homozygous ("cwcw"). Shades of red will only appear if the dog is "ee" in the second
-            locus, or if the Agouti set is active (Kbr or k most dominant in the first pair).
-            """
-            red_color = None
-
-            if red_based or agouti:
-                if "C" in self.alleles[11]:
-                    red_color = "Red"
-                elif "cch" in self.alleles[11]:
-                    if agouti == "Points":
-                        red_color = "Tan"
-                    else:
-                        red_color = "Fawn"
-                elif "ce" in self.alleles[11]:
-                    red_color = "Cream"
-                elif self.genomes[11] == "cwcw":
-                    red_color = "Silver"
-
-            """
-            What about Irish, Piebald, Extreme piebald?
-            These are white markings on your dog. The "White" (Pair #7) locus controls the appearance of white patterns. 
-            There are four alleles possible in this locus. The most dominant allele is "S" and causes a dog to have no 
-            white markings (self colored, in real life terms). "si" is the second most dominant in the set, causing 
-            "Irish" markings. "sp" is the third most dominant, creating a "Piebald" dog. Finally, "sw" is the least 
-            dominant allele, causing the "Extreme Piebald" whiting when appearing homozygously in a dog ("swsw"). Whiting 
-            levels appear alongside the colors and markings above.
-            """
-
-            white_color = False
-            if "S" in self.alleles[7]:
-                white_color = False
-            elif "si" in self.alleles[7]:
-                white_color = "Irish"
-            elif "sp" in self.alleles[7]:
-                white_color = "Piebald"
-            elif self.genomes[7] == "swsw":
-                white_color = "Extreme Piebald"
-
-            roaning = False
-            ticking = False
-            if white_color:
-                if "R" in self.alleles[9]:
-                    roaning = "Roaning"
-
-                if "T" in self.alleles[10]:
-                    ticking = "Ticking"
-                    roaning = False
-                elif 'ts' in self.alleles[10]:
-                    ticking = "Dalmation Spots"
-
-            undersides = "U" in self.alleles[13]
-
-            silvering = "Sl" in self.alleles[5]
-
-            if silvering:
-                summary = "Solid White"
-                return
-
-            if brindled:
-                summary += "Brindle "
-
-            if (solid_black or non_solid_black) and agouti != "Sable":
-                base_color = black_color
-            elif red_color:
-                base_color = red_color
             else:
-                base_color = "WTF"
-
-            summary += base_color
+                black_color = "Isabella"
 
-            if merled:
-                summary += " Merle"
+        mask_color = black_color
 
-            if white_color:
-                summary += " and White (%s)" % white_color
-
-            with_ = False
-            if agouti:
-                agouti_color = black_color
+        if c12 == "G":
+            if black_color == "Black":
+                black_color = "Steel Blue"
+            elif black_color == "Chocolate":
+                black_color = "Faded Brown"
+            elif black_color == "Blue":
+                black_color = "Faded Blue"
+            else:
+                black_color = "Faded Isabella"
+
+        merled = c8 == "M"
+        if merled and black_color == "Black":
+            black_color = "Blue"
+
+        return black_color, mask_color, merled
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def colors(pattern, pigment, c11):
+        (solid_black, brindled, agouti, black_mask, non_solid_black, red_based) = pattern
+        (black_color, mask_color, merled) = pigment
+
+        """
+        How about all those shades of red?
+        The shades of red are controlled by the "Color Intensity" (Pair #11) locus. "C" is the most dominant, causing 
+        the color "Red." "cch" is the next most dominant, causing the color "Fawn" on dogs, or "Tan" when occurring in 
+        the "Points" marking. "ce" is the next dominant, causing the color "Cream," and "cw" is the most recessive, 
+        causing "Silver" only when homozygous ("cwcw"). Shades of red will only appear if the dog is "ee" in the second
+        locus, or if the Agouti set is active (Kbr or k most dominant in the first pair).
+        """
+        red_color = None
+
+        if red_based or agouti:
+            if c11 == "C":
+                red_color = "Red"
+            elif c11 == "cch":
                 if agouti == "Points":
-                    agouti_color = red_color
-                summary += " with %s %s" % (agouti_color, agouti)
-                with_ = True
-
-            if black_mask:
-                if not with_:
-                    summary += " with"
-                    with_ = True
-                else:
-                    summary += " and"
-
-                if black_color != mask_color:
-                    summary += " %s" % mask_color
-                summary += " Mask"
-
-            if roaning:
-                if not with_:
-                    summary += " with"
-                    with_ = True
+                    red_color = "Tan"
                 else:
-                    summary += " and"
-                summary += " Roaning"
+                    red_color = "Fawn"
+            elif c11 == "ce":
+                red_color = "Cream"
+            elif c11 == "cw":
+                red_color = "Silver"
 
-            if ticking:
-                if not with_:
-                    summary += " with"
-                    with_ = True
-                else:
-                    summary += " and"
-                summary += " %s" % ticking
+        summary = ""
+        if brindled:
+            summary += "Brindle "
+
+        if (solid_black or non_solid_black) and agouti != "Sable":
+            base_color = black_color
+        elif red_color:
+            base_color = red_color
+        else:
+            base_color = "WTF"
+
+        summary += base_color
+
+        if merled:
+            summary += " Merle"
+
+        # Everything from here on goes after the white markings, as "with X and Y"
+        markings = []
+        if agouti:
+            agouti_color = black_color
+            if agouti == "Points":
+                agouti_color = red_color
+            markings.append("%s %s" % (agouti_color, agouti))
+
+        if black_mask:
+            if black_color != mask_color:
+                markings.append("%s Mask" % mask_color)
+            else:
+                markings.append("Mask")
+
+        return summary, tuple(markings)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def white(c7, c9, c10):
+        """
+        What about Irish, Piebald, Extreme piebald?
+        These are white markings on your dog. The "White" (Pair #7) locus controls the appearance of white patterns. 
+        There are four alleles possible in this locus. The most dominant allele is "S" and causes a dog to have no 
+        white markings (self colored, in real life terms). "si" is the second most dominant in the set, causing 
+        "Irish" markings. "sp" is the third most dominant, creating a "Piebald" dog. Finally, "sw" is the least 
+        dominant allele, causing the "Extreme Piebald" whiting when appearing homozygously in a dog ("swsw"). Whiting 
+        levels appear alongside the colors and markings above.
+        """
+        white_color = CoatColorGenetics.white_names.get(c7, False)
 
-            if undersides:
-                if not with_:
-                    summary += " with"
-                    with_ = True
-                else:
-                    summary += " and"
-                summary += " Light Undersides"
+        summary = ""
+        markings = []
+        if white_color:
+            summary = " and White (%s)" % white_color
 
-        finally:
-            return summary
+            if c10 == "T":
+                markings.append("Ticking")
+            else:
+                if c9 == "R":
+                    markings.append("Roaning")
+                if c10 == "ts":
+                    markings.append("Dalmation Spots")
+
+        return summary, tuple(markings)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def phenotype(colors, white, c13, c5):
+        if c5 == "Sl":
+            return "Solid White"
+
+        markings = colors[1] + white[1]
+        if c13 == "U":
+            markings += ("Light Undersides",)
+
+        summary = colors[0] + white[0]
+        if markings:
+            summary += " with " + " and ".join(markings)
+        return summary
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def offspring_classes(index, dad_pair, mom_pair):
+        odds = defaultdict(float)
+        for dad in dad_pair:
+            for mom in mom_pair:
+                odds[CoatColorGenetics.allele_class(index, (dad, mom))] += 0.25
+        return dict(odds)
+
+    @staticmethod
+    def combine(function, *distributions):
+        # Distribution of function(*keys) over independent distributions of its arguments
+        odds = defaultdict(float)
+        for combo in itertools.product(*[distribution.items() for distribution in distributions]):
+            chance = 1.0
+            for (key, value) in combo:
+                chance *= value
+            odds[function(*[key for (key, value) in combo])] += chance
+        return dict(odds)
+
+    @classmethod
+    def litter_phenotypes(cls, dad_alleles, mom_alleles, floor=None):
+        # Chance of each coat phenotype among the pups of a pair.  Rather than
+        # every combination of pup genomes, only the dominance classes of each
+        # locus are enumerated, a few loci at a time in the same stages that
+        # describe() goes through.  Phenotypes rarer than floor (default
+        # phenotype_floor, 0 for the full table) go together under "Other",
+        # so the odds always add up to 1.
+        if floor is None:
+            floor = cls.phenotype_floor
+        odds = cls.coat_phenotypes(tuple(tuple(pair) for pair in dad_alleles[1:14]),
+                                   tuple(tuple(pair) for pair in mom_alleles[1:14]))
+        if not floor:
+            return dict(odds)
+
+        listed = {phenotype: chance for (phenotype, chance) in odds.items() if chance >= floor}
+        if len(listed) < len(odds):
+            listed["Other"] = sum(chance for (phenotype, chance) in odds.items() if chance < floor)
+        return listed
+
+    @classmethod
+    @lru_cache(maxsize=4096)
+    def coat_phenotypes(cls, dad_coat, mom_coat):
+        classes = {index: cls.offspring_classes(index, dad_pair, mom_pair)
+                   for (index, dad_pair, mom_pair) in zip(range(1, 14), dad_coat, mom_coat)}
+
+        odds = {}
+        silvering = classes[5]
+        if "Sl" in silvering:
+            odds["Solid White"] = silvering["Sl"]
+        if "sl" not in silvering:
+            return odds
+
+        patterns = cls.combine(cls.pattern, classes[1], classes[2], classes[6])
+        pigments = cls.combine(cls.pigment, classes[3], classes[4], classes[12], classes[8])
+        colors = cls.combine(cls.colors, patterns, pigments, classes[11])
+        whites = cls.combine(cls.white, classes[7], classes[9], classes[10])
+        phenotypes = cls.combine(cls.phenotype, colors, whites, classes[13], {"sl": silvering["sl"]})
+        odds.update(phenotypes)
+        return odds
+
+
+CoatColorGenetics.class_tables = CoatColorGenetics.build_class_tables()
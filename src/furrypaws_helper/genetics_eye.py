@@ -1,3 +1,4 @@
+import itertools
 import logging
 
 from furrypaws_helper.genetics_base import BaseGenetics
@@ -23,22 +24,40 @@ Blue - "M" allele in pair 8 (MM/Mm, merle dogs)
 
 class EyeColorGenetics(BaseGenetics):
     type_ = "eye color"
+    dominance = {
+        0: ["P", "p", "y"],
+        3: ["B", "b"],
+        4: ["D", "d"],
+        8: ["M", "m"],
+    }
+
+    # Filled in below the class: signature -> eye color, for every signature
+    phenotypes = {}
 
     def summarize(self):
-        if "P" in self.genomes[0]:
-            if "M" in self.genomes[8]:
+        return self.phenotypes[self.signature(self.genomes)]
+
+    @classmethod
+    def build_phenotypes(cls):
+        return {signature: cls.describe(*signature)
+                for signature in itertools.product(*cls.dominance.values())}
+
+    @staticmethod
+    def describe(c0, c3, c4, c8):
+        if c0 == "P":
+            if c8 == "M":
                 summary = "Blue eyes"
-            elif self.genomes[3] == 'bb' or self.genomes[4] == 'dd':
+            elif c3 == "b" or c4 == "d":
                 summary = "Amber eyes"
-            elif "B" in self.genomes[3]:
+            elif c3 == "B":
                 summary = "Brown eyes"
             else:
                 summary = "WTF"
             summary += " (Normal eye color)"
-        elif "p" in self.genomes[0]:
-            if self.genomes[3] == 'bb' or self.genomes[4] == 'dd':
+        elif c0 == "p":
+            if c3 == "b" or c4 == "d":
                 summary = "Amber eyes"
-            elif "B" in self.genomes[3]:
+            elif c3 == "B":
                 summary = "Brown eyes"
             else:
                 summary = "WTF"
@@ -47,3 +66,7 @@ class EyeColorGenetics(BaseGenetics):
             return "Blue eyes"
 
         return summary
+
+
+EyeColorGenetics.class_tables = EyeColorGenetics.build_class_tables()
+EyeColorGenetics.phenotypes = EyeColorGenetics.build_phenotypes()
@@ -41,6 +41,8 @@ class HealthGenetics(BaseGenetics):
     type_ = "health"
     threshholds = [("P", 5), ("F", 3), ("G", 1), ("E", 0)]
     types = ["HH", "Hh", "hh"]
+    blocks = ["hip", "elbow", "eye", "ear"]
+    block_size = 6
 
     def summarize(self):
         blocks = []
@@ -48,15 +50,38 @@ class HealthGenetics(BaseGenetics):
             blocks.append(self.genomes[i:i + 6])
         health_slice = self.genomes[17:41]
 
-        ratings = []
-        for block in blocks:
-            defects = block.count("hh")
-            for (rating, min_count) in self.threshholds:
-                if defects >= min_count:
-                    ratings.append(rating)
-                    break
+        ratings = [self.rating_for(block.count("hh")) for block in blocks]
 
         healths = {type_: health_slice.count(type_) for type_ in self.types}
         healths = list(map(lambda x: "%d%s" % (x[1], x[0]), filter(lambda x: x[1] > 0, sorted(healths.items()))))
 
         return " ".join(["".join(ratings)] + healths)
+
+    @classmethod
+    def rating_for(cls, defects):
+        for (rating, min_count) in cls.threshholds:
+            if defects >= min_count:
+                return rating
+        return None
+
+    @classmethod
+    def rating_odds(cls, dad_alleles, mom_alleles):
+        # Exact chance of each rating in each block for a pup of this pair.
+        # Every locus is an independent trial, hh with chance (dad h / 2) * (mom h / 2),
+        # so the hh count of a block is Poisson-binomial over its six loci.
+        odds = {}
+        excellent = 1.0
+        for (block, start) in zip(cls.blocks, range(17, 41, cls.block_size)):
+            counts = [1.0]
+            for index in range(start, start + cls.block_size):
+                p = dad_alleles[index].count("h") * mom_alleles[index].count("h") / 4.0
+                counts = [(counts[k] * (1.0 - p) if k < len(counts) else 0.0) + (counts[k - 1] * p if k else 0.0)
+                          for k in range(len(counts) + 1)]
+
+            ratings = {rating: 0.0 for (rating, min_count) in reversed(cls.threshholds)}
+            for (defects, chance) in enumerate(counts):
+                ratings[cls.rating_for(defects)] += chance
+            odds[block] = ratings
+            excellent *= ratings["E"]
+
+        return odds, excellent
@@ -1,7 +1,18 @@
+import hashlib
+import itertools
+import json
 import logging
+import os
 import sys
+import threading
+from argparse import ArgumentParser
+from collections import OrderedDict, deque
+from types import MappingProxyType
 
+from furrypaws_helper import process_pool, setup_logging
+from furrypaws_helper.compact_genotype import CompactGenotype
 from furrypaws_helper.exceptions import BadGenotype, BadGenome
+from furrypaws_helper.genetics_base import BaseGenetics
 from furrypaws_helper.genetics_coat import CoatColorGenetics
 from furrypaws_helper.genetics_eye import EyeColorGenetics
 from furrypaws_helper.genetics_health import HealthGenetics
@@ -34,28 +45,214 @@ class Genotype(object):
         if len(genomes) != 41:
             raise BadGenotype("Genotypes must have 41 genomes, not %d" % len(genomes))
         self.genome_list = genomes
+
+        # Parse once, and let every interpreter read from the same allele pairs
+        alleles = BaseGenetics.split_genomes(genomes)
         self.genomes = {
-            "eye-color": EyeColorGenetics(genomes),
-            "coat-color": CoatColorGenetics(genomes),
-            "litter-size": LitterSizeGenetics(genomes),
-            "stat-boost": StatBoostGenetics(genomes),
-            "health": HealthGenetics(genomes),
+            "eye-color": EyeColorGenetics(genomes, alleles),
+            "coat-color": CoatColorGenetics(genomes, alleles),
+            "litter-size": LitterSizeGenetics(genomes, alleles),
+            "stat-boost": StatBoostGenetics(genomes, alleles),
+            "health": HealthGenetics(genomes, alleles),
         }
         self.summary = {key: value.get_summary() for (key, value) in self.genomes.items()}
-        self.alleles = self.genomes["health"].alleles
+        self.alleles = alleles
 
     def get_summary(self):
         return self.summary
 
+    def to_compact(self):
+        return CompactGenotype.from_text(self.text)
 
-if __name__ == "__main__":
+
+class CachedGenotype(object):
+    # What the genotype cache keeps of a parsed genotype: the CompactGenotype,
+    # the sorted allele pairs as tuples shared by every genotype with the same
+    # pair at a locus, and a read-only summary.  None of it can be changed, so
+    # it is safe to hand the same one to every caller.
+    __slots__ = ("compact", "alleles", "summary")
+
+    # For each locus, (allele index, allele index) -> sorted allele pair, as
+    # from BaseGenetics.split_genomes()
+    pair_tables = [{(i, j): tuple(sorted([first, second]))
+                    for (i, first) in enumerate(alleles) for (j, second) in enumerate(alleles)}
+                   for alleles in BaseGenetics.possible_alleles]
+
+    def __init__(self, genotype):
+        compact = CompactGenotype.from_text(genotype.text)
+        alleles = tuple(table[compact.pair(index)] for (index, table) in enumerate(self.pair_tables))
+        summary = MappingProxyType({key: sys.intern(value) if isinstance(value, str) else value
+                                    for (key, value) in genotype.get_summary().items()})
+        object.__setattr__(self, "compact", compact)
+        object.__setattr__(self, "alleles", alleles)
+        object.__setattr__(self, "summary", summary)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Genotypes are shared through the genotype cache and cannot be changed")
+
+    def get_summary(self):
+        return self.summary
+
+    @property
+    def text(self):
+        return self.compact.to_text()
+
+
+class GenotypeCache(object):
+    # Bounded LRU of parsed genotypes keyed by their text.  Holds a
+    # CachedGenotype per genotype (about a kilobyte, key and all) rather than the
+    # Genotype with its trait interpreters, and the same one is handed back
+    # for identical text.
+    def __init__(self, maxsize=65536):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, text):
+        key = text.strip()
+        with self.lock:
+            genotype = self.cache.get(key, None)
+            if genotype is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return genotype
+
+        # Parse outside of the lock, bad genotypes raise and are not cached
+        genotype = CachedGenotype(Genotype(key))
+
+        with self.lock:
+            self.misses += 1
+            existing = self.cache.get(key, None)
+            if existing is not None:
+                # Somebody else beat us to it, keep theirs so there is only one
+                self.cache.move_to_end(key)
+                return existing
+
+            self.cache[key] = genotype
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+                self.evictions += 1
+        return genotype
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "size": len(self.cache),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+genotype_cache = GenotypeCache()
+
+
+def get_genotype(text):
+    return genotype_cache.get(text)
+
+
+def genotype_hash(text):
+    # Stable key for a genotype's text, whitespace aside
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def summarize_lines(lines):
+    # Batch mode worker: (line number, text) in, (line number, summary, error) out
+    results = []
+    for (number, text) in lines:
+        try:
+            results.append((number, Genotype(text).get_summary(), None))
+        except (BadGenotype, BadGenome) as e:
+            results.append((number, None, str(e)))
+    return results
+
+
+def read_chunks(infile, chunk_size):
+    # Non-blank lines, numbered from 1, chunk_size at a time
+    lines = ((number, line.strip()) for (number, line) in enumerate(infile, 1) if line.strip())
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def process_batch(infile, outfile, jobs=None, chunk_size=1000):
+    # Summarizes every line of infile as JSON Lines, in input order.  Only a
+    # couple of chunks per worker are in flight at a time, so memory stays
+    # flat however long the input is.  Bad lines go to the log, with their
+    # line numbers.
+    if not jobs:
+        jobs = os.cpu_count() or 1
+    counts = {"good": 0, "bad": 0}
+
+    def write(future):
+        for (number, summary, error) in future.result():
+            if error:
+                logger.error("Line %d: %s" % (number, error))
+                counts["bad"] += 1
+                continue
+            outfile.write(json.dumps({"line": number, "summary": summary}, sort_keys=True) + "\n")
+            counts["good"] += 1
+
+    with process_pool(jobs) as executor:
+        pending = deque()
+        for chunk in read_chunks(infile, chunk_size):
+            pending.append(executor.submit(summarize_lines, chunk))
+            if len(pending) >= 2 * jobs:
+                write(pending.popleft())
+        while pending:
+            write(pending.popleft())
+
+    logger.info("Summarized %d genotypes, %d bad lines" % (counts["good"], counts["bad"]))
+    return counts["bad"]
+
+
+def main():
+    parser = ArgumentParser(description="Summarize genotypes, one per line")
+    parser.add_argument("-b", "--batch", action="store_true",
+                        help="Summarize all of the input on a pool of processes, as JSON Lines")
+    parser.add_argument("-i", "--input-file", action="store", default=None, help="Input file (default: stdin)")
+    parser.add_argument("-o", "--output-file", action="store", default=None, help="Output file (default: stdout)")
+    parser.add_argument("-j", "--jobs", action="store", type=int, default=None,
+                        help="Worker processes in batch mode (default: one per CPU)")
+    parser.add_argument("-c", "--chunk-size", action="store", type=int, default=1000,
+                        help="Lines per unit of work in batch mode (default: %(default)s)")
+    args = parser.parse_args()
+
+    infile = open(args.input_file, "r") if args.input_file else sys.stdin
+    outfile = open(args.output_file, "w") if args.output_file else sys.stdout
     try:
-        for line in sys.stdin:
+        if args.batch:
+            setup_logging(logging.INFO)
+            return 1 if process_batch(infile, outfile, args.jobs, args.chunk_size) else 0
+
+        for line in infile:
             try:
                 genotype = Genotype(line)
-                print(genotype.get_summary())
+                print(genotype.get_summary(), file=outfile)
             except (BadGenotype, BadGenome) as e:
-                print(e)
+                print(e, file=outfile)
                 continue
     except KeyboardInterrupt:
-        sys.exit(0)
+        return 0
+    finally:
+        if args.input_file:
+            infile.close()
+        if args.output_file:
+            outfile.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import json
+import logging
+import sqlite3
+import sys
+from argparse import ArgumentParser
+
+from furrypaws_helper import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+class KennelStore(object):
+    # SQLite home for the scraped dogs, one row per dog id.  The full record
+    # is kept as JSON, with the columns the pairing filters on pulled out and
+    # indexed so a run only has to read the dogs it actually needs.  Dogs come
+    # back in the order of the kennel list they were stored from, same as
+    # reading the list itself.
+    def __init__(self, filename):
+        logger.info("Opening kennel store %s" % filename)
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS dogs (
+                id INTEGER PRIMARY KEY,
+                name TEXT,
+                breed TEXT,
+                sex TEXT,
+                breedable INTEGER NOT NULL DEFAULT 0,
+                genotype TEXT,
+                summary TEXT,
+                last_update REAL,
+                data TEXT NOT NULL,
+                position INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS dogs_breeding ON dogs (breed, sex, breedable);
+            CREATE INDEX IF NOT EXISTS dogs_genotype ON dogs (genotype);
+        """)
+        self.connection.commit()
+
+    def upsert(self, dogs):
+        # Add or update the given dogs, leaving the others alone
+        self.store(dogs)
+        self.connection.commit()
+
+    def replace(self, dogs):
+        # Make the given dogs the whole kennel: dogs missing from them (sold,
+        # dead, gone) are deleted along with the update
+        with self.connection:
+            ids = self.store(dogs)
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS kept (id INTEGER PRIMARY KEY)")
+            self.connection.execute("DELETE FROM kept")
+            self.connection.executemany("INSERT INTO kept VALUES (?)", [(id_,) for id_ in ids])
+            deleted = self.connection.execute("DELETE FROM dogs WHERE id NOT IN (SELECT id FROM kept)").rowcount
+        logger.info("Removed %d dogs no longer in the kennel" % deleted)
+
+    def store(self, dogs):
+        # Ids of the dogs stored
+        first = self.connection.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM dogs").fetchone()[0]
+        rows = []
+        for (index, dog) in enumerate(dogs):
+            if dog.get("id", None) is None:
+                logger.warning("No id for %s.  Skipping" % dog.get("name", None))
+                continue
+
+            rows.append((dog.get("id"), dog.get("name", None), dog.get("breed", None), dog.get("sex", None),
+                         int(bool(dog.get("breedable", False))), dog.get("genotype", None),
+                         json.dumps(dog.get("summary", {}), sort_keys=True), dog.get("last-update", None),
+                         json.dumps(dog, sort_keys=True), first + index))
+
+        logger.info("Storing %d dogs" % len(rows))
+        self.connection.executemany("INSERT OR REPLACE INTO dogs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return [row[0] for row in rows]
+
+    def get(self, id_):
+        row = self.connection.execute("SELECT data FROM dogs WHERE id = ?", (id_,)).fetchone()
+        if not row:
+            return None
+        return json.loads(row[0])
+
+    def find_genotype(self, genotype):
+        rows = self.connection.execute("SELECT data FROM dogs WHERE genotype = ? ORDER BY position, id",
+                                       (genotype.strip(),))
+        return [json.loads(data) for (data,) in rows]
+
+    def all_dogs(self):
+        rows = self.connection.execute("SELECT data FROM dogs ORDER BY position, id")
+        return [json.loads(data) for (data,) in rows]
+
+    def breeds(self):
+        rows = self.connection.execute("SELECT DISTINCT breed FROM dogs WHERE breedable = 1 ORDER BY breed")
+        return [breed for (breed,) in rows]
+
+    def dogs(self, breed, sex, breedable=True):
+        rows = self.connection.execute(
+            "SELECT data FROM dogs WHERE breed = ? AND sex = ? AND breedable = ? ORDER BY position, id",
+            (breed, sex, int(breedable)))
+        return [json.loads(data) for (data,) in rows]
+
+    def breeding_dogs(self):
+        # Same shape process_file builds from the kennel list: breed -> sex -> dogs
+        dogs = {}
+        for breed in self.breeds():
+            dogs[breed] = {}
+            for sex in ["Female", "Male"]:
+                found = [dog for dog in self.dogs(breed, sex) if dog.get("genotype", None)]
+                if found:
+                    dogs[breed][sex] = found
+        return dogs
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    parser = ArgumentParser(description="Load a kennel list into a kennel store")
+    parser.add_argument("-d", "--debug", action="store_true", help="Turn on debug output")
+    parser.add_argument("-i", "--input-file", action="store", help="Input file", default="kennel-list.json")
+    parser.add_argument("-s", "--store", action="store", help="Kennel store", default="kennel.db")
+    parser.add_argument("-u", "--update", action="store_true",
+                        help="Only add and update dogs, keep the ones missing from the kennel list")
+    args = parser.parse_args()
+
+    level = logging.INFO
+    if args.debug:
+        level = logging.DEBUG
+    setup_logging(level)
+
+    logger.info("Reading kennel list")
+    with open(args.input_file, "r") as f:
+        kennel = json.load(f)
+
+    store = KennelStore(args.store)
+    if args.update:
+        store.upsert(kennel)
+    else:
+        store.replace(kennel)
+    store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import cProfile
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics(object):
+    # Wall time and call counts per stage, plus plain counters.  Stages can
+    # be labelled (e.g. breed="Akita", bitch="Dog 4") to get a breakdown of
+    # each stage by label value as well.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.stages = {}
+            self.counters = {}
+            self.breakdowns = {}
+
+    @staticmethod
+    def record(stages, stage, seconds, count):
+        entry = stages.setdefault(stage, {"count": 0, "seconds": 0.0})
+        entry["count"] += count
+        entry["seconds"] += seconds
+
+    def add(self, stage, seconds, count=1, **labels):
+        with self.lock:
+            self.record(self.stages, stage, seconds, count)
+            for (label, value) in labels.items():
+                if value is None:
+                    continue
+                group = self.breakdowns.setdefault(label, {}).setdefault(str(value), {})
+                self.record(group, stage, seconds, count)
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, **labels)
+
+    def count(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def merge(self, snapshot):
+        # Fold in the metrics a worker process recorded, see measured()
+        with self.lock:
+            for (stage, entry) in snapshot.get("stages", {}).items():
+                self.record(self.stages, stage, entry["seconds"], entry["count"])
+            for (counter, value) in snapshot.get("counters", {}).items():
+                self.counters[counter] = self.counters.get(counter, 0) + value
+            for (label, groups) in snapshot.get("breakdowns", {}).items():
+                for (value, stages) in groups.items():
+                    group = self.breakdowns.setdefault(label, {}).setdefault(value, {})
+                    for (stage, entry) in stages.items():
+                        self.record(group, stage, entry["seconds"], entry["count"])
+
+    def get_stats(self):
+        with self.lock:
+            return json.loads(json.dumps({
+                "wall": time.time() - self.started,
+                "stages": self.stages,
+                "counters": self.counters,
+                "breakdowns": self.breakdowns,
+            }))
+
+    def log(self):
+        for (stage, entry) in sorted(self.get_stats()["stages"].items(), key=lambda x: -x[1]["seconds"]):
+            logger.info("%s: %.3fs in %d calls" % (stage, entry["seconds"], entry["count"]))
+
+    def save(self, filename):
+        logger.info("Saving metrics to %s" % filename)
+        with open(filename, "w") as f:
+            json.dump(self.get_stats(), f, indent=2, sort_keys=True)
+
+
+# Shared by everything in the process
+metrics = Metrics()
+
+
+def measured(function, *args):
+    # Run in a worker process: function's result, along with the metrics it
+    # recorded there for the parent to merge() (see measured_result())
+    metrics.reset()
+    result = function(*args)
+    snapshot = metrics.get_stats()
+    metrics.reset()
+    return result, snapshot
+
+
+def measured_result(future):
+    (result, snapshot) = future.result()
+    metrics.merge(snapshot)
+    return result
+
+
+@contextmanager
+def profiled(filename=None):
+    # cProfile whatever runs inside, dumping the stats to filename.  No
+    # filename, no profiling.
+    if not filename:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        logger.info("Saving profile to %s" % filename)
+        profile.dump_stats(filename)
@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+import time
+from hashlib import md5
+
+logger = logging.getLogger(__name__)
+
+
+class PageCache(object):
+    # Page cache for the async scraper.  Bodies are laid out the way laracna's
+    # HttpCache writes them (status code line, then the body, under the md5 of
+    # the url), with the ETag/Last-Modified the server sent kept alongside.
+    # Unlike HttpCache an expired page is not thrown away: it is kept so that
+    # it can be revalidated with a conditional request.
+    def __init__(self, basedir, expiry=None):
+        os.makedirs(basedir, 0o755, exist_ok=True)
+        self.basedir = basedir
+
+        if not expiry:
+            expiry = 3600.0
+        self.expiry = expiry
+
+    @staticmethod
+    def sanitize_url(url):
+        return md5(url.encode("utf-8")).hexdigest()
+
+    def filenames(self, url):
+        filename = os.path.join(self.basedir, self.sanitize_url(url))
+        return filename, filename + ".meta"
+
+    def lookup(self, url):
+        # The cached item, fresh or not, with "fresh" set; None when not cached
+        (filename, meta_filename) = self.filenames(url)
+        try:
+            mtime = os.path.getmtime(filename)
+            with open(filename, "r") as f:
+                code = int(f.readline().strip())
+                body = f.read()
+        except Exception:
+            return None
+
+        try:
+            with open(meta_filename, "r") as f:
+                meta = json.load(f)
+        except Exception:
+            meta = {}
+
+        return {
+            "code": code,
+            "url": url,
+            "body": body,
+            "ctime": mtime,
+            "etag": meta.get("etag", None),
+            "last-modified": meta.get("last-modified", None),
+            "fresh": time.time() < mtime + self.expiry,
+        }
+
+    def get(self, url):
+        # Same as HttpCache.get(): only hands back pages that have not expired
+        item = self.lookup(url)
+        if item is None or not item["fresh"]:
+            return None
+        return item
+
+    def put(self, url, code, body, etag=None, last_modified=None):
+        # Error pages are not kept, or they would be served until they expire
+        if code // 100 != 2:
+            return
+        (filename, meta_filename) = self.filenames(url)
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        with open(filename, "w") as f:
+            f.write("\n".join([str(code), body]))
+        with open(meta_filename, "w") as f:
+            json.dump({"etag": etag, "last-modified": last_modified}, f)
+
+    def refresh(self, url):
+        # The server says the page has not changed: start its expiry over
+        (filename, meta_filename) = self.filenames(url)
+        try:
+            os.utime(filename)
+        except OSError:
+            logger.warning("Could not refresh cached page for %s" % url)
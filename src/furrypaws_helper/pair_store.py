@@ -0,0 +1,143 @@
+import json
+import logging
+import sqlite3
+
+from furrypaws_helper.genotype import genotype_hash
+
+logger = logging.getLogger(__name__)
+
+
+class PairStore(object):
+    # Keeps the litter of every stud x bitch pair worked out so far, keyed by
+    # the dogs' ids and the hashes of their genotypes, so that a later run only
+    # has to work out the pairs where one of the dogs is new or has changed.
+    # Dogs without an id are never stored, their pairs are worked out every
+    # time.  Bump version whenever the contents of a litter change.  settings
+    # are whatever else the litters were worked out with (the coat color
+    # floor, say); stored pairs from a run with other settings are thrown away.
+    version = 3
+
+    def __init__(self, filename, settings=None):
+        logger.info("Opening pair store %s" % filename)
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS pairs (
+                stud_id TEXT NOT NULL,
+                bitch_id TEXT NOT NULL,
+                stud_hash TEXT NOT NULL,
+                bitch_hash TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                litter TEXT NOT NULL,
+                PRIMARY KEY (bitch_id, stud_id)
+            )""")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.check_settings(settings or {})
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def check_settings(self, settings):
+        wanted = {key: json.dumps(value) for (key, value) in settings.items()}
+        stored = dict(self.connection.execute("SELECT key, value FROM settings"))
+        if stored == wanted:
+            return
+        logger.info("Pair store settings changed, dropping the stored pairs")
+        self.connection.execute("DELETE FROM pairs")
+        self.connection.execute("DELETE FROM settings")
+        self.connection.executemany("INSERT INTO settings VALUES (?, ?)", wanted.items())
+
+    @staticmethod
+    def dog_id(dog):
+        # None when the dog has no id
+        dog_id = dog.get("id", None)
+        return None if dog_id is None else str(dog_id)
+
+    def current_rows(self, bitch, males, columns):
+        # (index into males, row) for every stored pair that is still current
+        bitch_id = self.dog_id(bitch)
+        if bitch_id is None:
+            return []
+
+        rows = self.connection.execute(
+            "SELECT stud_id, stud_hash, bitch_hash, version, %s FROM pairs WHERE bitch_id = ?" % columns, (bitch_id,))
+        stored = {row[0]: row for row in rows}
+
+        bitch_hash = genotype_hash(bitch.get("genotype", ""))
+        current = []
+        for (index, stud) in enumerate(males):
+            stud_id = self.dog_id(stud)
+            row = stored.get(stud_id, None) if stud_id is not None else None
+            if row is not None and row[1] == genotype_hash(stud.get("genotype", "")) and row[2] == bitch_hash and \
+                    row[3] == self.version:
+                current.append((index, row))
+        return current
+
+    def stored_litters(self, bitch, males):
+        # {index into males: dumped litter} for every stored pair that is still
+        # current, see load_litter()
+        stored = {index: row[4] for (index, row) in self.current_rows(bitch, males, "litter")}
+        self.hits += len(stored)
+        self.misses += len(males) - len(stored)
+        return stored
+
+    def get_litters(self, bitch, males):
+        # {index into males: litter} for every stored pair that is still current
+        return {index: self.load_litter(text, males[index], bitch)
+                for (index, text) in self.stored_litters(bitch, males).items()}
+
+    @staticmethod
+    def dump_litter(litter):
+        # Names are not part of the key, so they are not stored either
+        litter = {key: value for (key, value) in litter.items() if key not in ["stud", "bitch"]}
+        return json.dumps(litter, sort_keys=True, separators=(",", ":"))
+
+    @staticmethod
+    def load_litter(text, stud, bitch):
+        # Always with the current names
+        litter = json.loads(text)
+        litter["stud"] = stud.get("name")
+        litter["bitch"] = bitch.get("name")
+        return litter
+
+    def put_litters(self, bitch, pairs):
+        # pairs: (stud, litter) tuples for the given bitch
+        self.put_dumped(bitch, [(stud, self.dump_litter(litter)) for (stud, litter) in pairs])
+
+    def put_dumped(self, bitch, pairs):
+        # pairs: (stud, litter from dump_litter()) tuples for the given bitch
+        bitch_id = self.dog_id(bitch)
+        if bitch_id is None:
+            return
+        bitch_hash = genotype_hash(bitch.get("genotype", ""))
+        rows = []
+        for (stud, text) in pairs:
+            stud_id = self.dog_id(stud)
+            if stud_id is None:
+                continue
+            rows.append((stud_id, bitch_id, genotype_hash(stud.get("genotype", "")), bitch_hash, self.version, text))
+        self.connection.executemany("INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def prune(self, dogs):
+        # Drop the pairs of every dog not among the given ones
+        with self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS kept (id TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM kept")
+            self.connection.executemany("INSERT OR IGNORE INTO kept VALUES (?)",
+                                        [(dog_id,) for dog_id in map(self.dog_id, dogs) if dog_id is not None])
+            deleted = self.connection.execute("DELETE FROM pairs WHERE bitch_id NOT IN (SELECT id FROM kept) "
+                                              "OR stud_id NOT IN (SELECT id FROM kept)").rowcount
+        logger.info("Removed %d pairs of dogs no longer breeding" % deleted)
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def get_stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,295 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from furrypaws_helper import setup_logging
+from furrypaws_helper.batch_breeding import BatchBreeder
+from furrypaws_helper.exceptions import AmbiguousDog, BadGenome, BadGenotype, UnknownDog
+from furrypaws_helper.genotype import genotype_cache, genotype_hash, get_genotype
+from furrypaws_helper.kennel_store import KennelStore
+from furrypaws_helper.potential_litter import PotentialLitter, bucket_dogs, rank_keys, summarize_litters
+
+logger = logging.getLogger(__name__)
+
+
+class BreedPairs(object):
+    # The breedable studs and bitches of one breed, with their BatchBreeder
+    # built on first use.  key tells whether a reload changed anything.
+    def __init__(self, males, females):
+        self.males = males
+        self.females = females
+        self.key = tuple((dog_key(dog), dog.get("name", None), genotype_hash(dog.get("genotype", "")))
+                         for dog in males + females)
+        self.bitch_indexes = {dog_key(dog): index for (index, dog) in enumerate(females)}
+        self.breeder = None
+        self.lock = threading.Lock()
+
+    def get_breeder(self):
+        with self.lock:
+            if self.breeder is None:
+                self.breeder = BatchBreeder(self.males, self.females)
+            return self.breeder
+
+
+def dog_key(dog):
+    return str(dog.get("id", dog.get("name", None)))
+
+
+class PairingService(object):
+    # Keeps the kennel, its parsed genotypes and the per breed breeders in
+    # memory between queries.  The kennel list (or store) is reloaded when it
+    # changes, and only the breeds whose dogs changed are set up again.
+    def __init__(self, infile=None, kennel_store=None):
+        self.infile = infile
+        self.kennel_store = kennel_store
+        self.source_stat = None
+        self.loaded = None
+        self.reloads = 0
+        self.queries = 0
+        self.queries_lock = threading.Lock()
+
+        # Swapped whole on reload, so queries never see half of one
+        self.dogs = {}
+        self.names = {}
+        self.breeds = {}
+        self.reload_lock = threading.Lock()
+        self.reload()
+
+    def source(self):
+        return self.kennel_store if self.kennel_store else self.infile
+
+    def load(self):
+        if self.kennel_store:
+            store = KennelStore(self.kennel_store)
+            dogs = store.all_dogs()
+            store.close()
+            return dogs
+
+        with open(self.infile, "r") as f:
+            return json.load(f)
+
+    def reload(self, force=False):
+        # True when the kennel was reloaded
+        with self.reload_lock:
+            stat = os.stat(self.source())
+            stat = (stat.st_mtime_ns, stat.st_size)
+            if not force and stat == self.source_stat:
+                return False
+
+            start = time.perf_counter()
+            kennel = self.load()
+            dogs = {dog_key(dog): dog for dog in kennel}
+            names = {}
+            for dog in kennel:
+                names.setdefault(dog.get("name", None), []).append(dog)
+
+            breeds = {}
+            (reused, parsed) = (0, 0)
+            for (breed, alldogs) in bucket_dogs(kennel).items():
+                pairs = BreedPairs([dog for dog in alldogs.get("Male", []) if self.parses(dog)],
+                                   [dog for dog in alldogs.get("Female", []) if self.parses(dog)])
+                old = self.breeds.get(breed, None)
+                if old is not None and old.key == pairs.key:
+                    pairs = old
+                    reused += 1
+                else:
+                    parsed += 1
+                breeds[breed] = pairs
+
+            (self.dogs, self.names, self.breeds) = (dogs, names, breeds)
+            self.source_stat = stat
+            self.loaded = time.time()
+            self.reloads += 1
+            logger.info("Loaded %d dogs from %s in %.3fs: %d breeds set up again, %d unchanged" %
+                        (len(dogs), self.source(), time.perf_counter() - start, parsed, reused))
+            return True
+
+    @staticmethod
+    def parses(dog):
+        # Also warms up the genotype cache.  A dog whose genotype doesn't
+        # parse is left out of the pairings rather than failing the reload.
+        try:
+            get_genotype(dog.get("genotype", ""))
+            return True
+        except (BadGenotype, BadGenome) as e:
+            logger.warning("Leaving %s out of the pairings: %s" % (dog.get("name", None), e))
+            return False
+
+    def watch(self, interval):
+        # Background thread polling the kennel for changes
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload()
+                except Exception:
+                    logger.exception("Reloading %s failed" % self.source())
+
+        thread = threading.Thread(target=poll, name="reload", daemon=True)
+        thread.start()
+        return thread
+
+    def count_query(self):
+        with self.queries_lock:
+            self.queries += 1
+
+    def find_dog(self, value):
+        # By id, or else by name
+        if not value:
+            raise ValueError("No dog given")
+        dog = self.dogs.get(value, None)
+        if dog is not None:
+            return dog
+
+        found = self.names.get(value, [])
+        if len(found) > 1:
+            raise AmbiguousDog("More than one dog is called %s, use one of the ids %s" %
+                               (value, ", ".join(dog_key(dog) for dog in found)))
+        if not found:
+            raise UnknownDog("No dog %s" % value)
+        return found[0]
+
+    def best_studs(self, bitch, top=10, rank="defects", full=False):
+        if rank not in rank_keys:
+            raise ValueError("Unknown rank %s" % rank)
+        bitch = self.find_dog(bitch)
+        if bitch.get("sex", None) != "Female":
+            raise ValueError("%s is not a bitch" % bitch.get("name", None))
+        breed = bitch.get("breed", None)
+        pairs = self.breeds.get(breed, None)
+        if pairs is None or not pairs.males:
+            litters = []
+        else:
+            index = pairs.bitch_indexes.get(dog_key(bitch), None)
+            if index is not None:
+                breeder = pairs.get_breeder()
+            else:
+                # Not one of the breedable bitches, work her out on her own
+                (breeder, index) = (BatchBreeder(pairs.males, [bitch]), 0)
+            studs = breeder.ranked_studs(index, rank, top)
+            litters = breeder.litters(index, studs)
+
+        result = {"mom": bitch.get("name", None), "breed": breed, "rank": rank, "litters": litters}
+        return result if full else summarize_litters(result)
+
+    def score_pair(self, stud, bitch, full=False):
+        (stud, bitch) = (self.find_dog(stud), self.find_dog(bitch))
+        if stud.get("sex", None) != "Male":
+            raise ValueError("%s is not a stud" % stud.get("name", None))
+        if bitch.get("sex", None) != "Female":
+            raise ValueError("%s is not a bitch" % bitch.get("name", None))
+        if stud.get("breed", None) != bitch.get("breed", None):
+            raise ValueError("%s (%s) and %s (%s) are not the same breed" %
+                             (stud.get("name", None), stud.get("breed", None),
+                              bitch.get("name", None), bitch.get("breed", None)))
+        litter = PotentialLitter(stud, bitch).litter
+        return litter if full else summarize_litters({"litters": [litter]})["litters"][0]
+
+    def get_stats(self):
+        return {
+            "source": self.source(),
+            "dogs": len(self.dogs),
+            "breeds": len(self.breeds),
+            "loaded": self.loaded,
+            "reloads": self.reloads,
+            "queries": self.queries,
+            "genotype-cache": genotype_cache.get_stats(),
+        }
+
+
+class PairingHandler(BaseHTTPRequestHandler):
+    # GET /best-studs?bitch=X[&top=10&rank=defects&full=1]
+    # GET /pair?stud=X&bitch=Y[&full=1]
+    # GET /status
+    # POST /reload
+    service = None
+
+    def send_json(self, code, data):
+        body = json.dumps(data, sort_keys=True).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[-1] for (key, values) in parse_qs(url.query).items()}
+        full = query.get("full", "") in ["1", "true", "yes"]
+        try:
+            if url.path == "/best-studs":
+                top = int(query.get("top", 10)) or None
+                result = self.service.best_studs(query.get("bitch", None), top, query.get("rank", "defects"), full)
+            elif url.path == "/pair":
+                result = self.service.score_pair(query.get("stud", None), query.get("bitch", None), full)
+            elif url.path == "/status":
+                result = self.service.get_stats()
+            else:
+                return self.send_json(404, {"error": "No such query %s" % url.path})
+        except UnknownDog as e:
+            return self.send_json(404, {"error": str(e)})
+        except (AmbiguousDog, BadGenotype, BadGenome, ValueError) as e:
+            return self.send_json(400, {"error": str(e)})
+        except Exception as e:
+            # e.g. a dog with a missing or short genotype
+            logger.exception("Failed on %s" % self.path)
+            return self.send_json(500, {"error": "%s: %s" % (e.__class__.__name__, e)})
+
+        self.service.count_query()
+        self.send_json(200, result)
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/reload":
+            return self.send_json(404, {"error": "No such query %s" % self.path})
+        try:
+            reloaded = self.service.reload(force=True)
+        except Exception as e:
+            logger.exception("Reloading %s failed" % self.service.source())
+            return self.send_json(500, {"error": "%s: %s" % (e.__class__.__name__, e)})
+        self.send_json(200, {"reloaded": reloaded})
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s" % (self.address_string(), format % args))
+
+
+def main():
+    parser = ArgumentParser(description="Answer pairing queries over HTTP with the kennel kept in memory")
+    parser.add_argument("-d", "--debug", action="store_true", help="Turn on debug output")
+    parser.add_argument("-i", "--input-file", action="store", help="Input file", default="kennel-list.json")
+    parser.add_argument("-s", "--store", action="store", default=None,
+                        help="Kennel store to read the dogs from instead of the input file")
+    parser.add_argument("-H", "--host", action="store", default="127.0.0.1",
+                        help="Address to listen on (default: %(default)s)")
+    parser.add_argument("-p", "--port", action="store", type=int, default=8642,
+                        help="Port to listen on (default: %(default)s)")
+    parser.add_argument("--poll", action="store", type=float, default=10.0,
+                        help="Seconds between checks for a changed kennel, 0 for never (default: %(default)s)")
+    args = parser.parse_args()
+
+    level = logging.INFO
+    if args.debug:
+        level = logging.DEBUG
+    setup_logging(level)
+
+    PairingHandler.service = PairingService(args.input_file, args.store)
+    if args.poll:
+        PairingHandler.service.watch(args.poll)
+
+    server = ThreadingHTTPServer((args.host, args.port), PairingHandler)
+    logger.info("Listening on %s:%d" % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
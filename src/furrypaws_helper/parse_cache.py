@@ -0,0 +1,95 @@
+import json
+import logging
+import sqlite3
+import time
+from hashlib import sha1
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class ParseCache(object):
+    # What the scraper callbacks made of a page (the dog results, the kennel
+    # chain), keyed by a hash of the page's url and body, so a page that comes
+    # back unchanged doesn't have to go through BeautifulSoup again.  Entries
+    # not used for expiry seconds are dropped.  Bump version whenever the
+    # parsing gives something different.
+    version = 1
+
+    def __init__(self, filename, expiry=None):
+        logger.info("Opening parse cache %s" % filename)
+        if not expiry:
+            expiry = 3600.0
+        self.expiry = expiry
+        self.filename = filename
+        # Used from the scraper threads too
+        self.lock = Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS parsed (
+                key TEXT PRIMARY KEY,
+                type TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                used REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS parsed_used ON parsed (used);
+        """)
+        self.evict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(type_, response):
+        body = response.get("body", "")
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        d = sha1(("%s\n%s\n" % (type_, response.get("url", ""))).encode("utf-8"))
+        d.update(body)
+        return d.hexdigest()
+
+    def evict(self):
+        with self.lock:
+            cursor = self.connection.execute("DELETE FROM parsed WHERE used < ? OR version != ?",
+                                             (time.time() - self.expiry, self.version))
+            self.connection.commit()
+        if cursor.rowcount:
+            logger.info("Evicted %d parsed pages" % cursor.rowcount)
+
+    def get(self, type_, response, key=None):
+        if key is None:
+            key = self.key(type_, response)
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM parsed WHERE key = ? AND version = ?",
+                                          (key, self.version)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE parsed SET used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+
+        callback_response = json.loads(row[0])
+        # Results carry the time of the page they were made from
+        results = callback_response.get("results", None)
+        if isinstance(results, dict) and "last-update" in results:
+            results["last-update"] = response.get("ctime", 0.0)
+        return callback_response
+
+    def put(self, type_, response, callback_response, key=None):
+        if key is None:
+            key = self.key(type_, response)
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO parsed VALUES (?, ?, ?, ?, ?)",
+                                    (key, type_, self.version, time.time(),
+                                     json.dumps(callback_response or {}, sort_keys=True)))
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def get_stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -1,23 +1,38 @@
 import json
 import logging
+import math
 import sys
+import textwrap
 from argparse import ArgumentParser
-from collections import defaultdict
+from collections import defaultdict, deque
+from functools import partial
 
-from furrypaws_helper import setup_logging
+from furrypaws_helper import process_pool, setup_logging
+from furrypaws_helper.batch_breeding import BatchBreeder
+from furrypaws_helper.genetics_coat import CoatColorGenetics
 from furrypaws_helper.genetics_health import HealthGenetics
 from furrypaws_helper.genetics_litter import LitterSizeGenetics
-from furrypaws_helper.genotype import Genotype
+from furrypaws_helper.genotype import genotype_cache, get_genotype
+from furrypaws_helper.kennel_store import KennelStore
+from furrypaws_helper.metrics import measured, measured_result, metrics, profiled
+from furrypaws_helper.pair_store import PairStore
 
 logger = logging.getLogger(__name__)
 
+# How the litters of each bitch get ordered, best first
+rank_keys = {
+    "defects": lambda x: x.get("avg-total-defect-alleles", 9999.99),
+    "excellent": lambda x: (-x.get("excellent-odds", 0.0), x.get("avg-total-defect-alleles", 9999.99)),
+}
+
 
 class PotentialLitter(object):
     def __init__(self, stud, bitch):
         self.stud = stud
         self.bitch = bitch
-        self.dad = Genotype(stud.get("genotype", ""))
-        self.mom = Genotype(bitch.get("genotype", ""))
+        # Parsed genotypes are shared, so each dog is only parsed once per run
+        self.dad = get_genotype(stud.get("genotype", ""))
+        self.mom = get_genotype(bitch.get("genotype", ""))
         self.litter = self.breed()
 
     def breed(self):
@@ -40,6 +55,8 @@ class PotentialLitter(object):
         expected_hhs = [genome.get("hh", 0) for genome in health_slice]
         expected_hh_count = sum(expected_hhs) / 100.0
 
+        (health_odds, excellent_odds) = HealthGenetics.rating_odds(dad_alleles, mom_alleles)
+
         ratings = []
         for i in range(0, 24, 6):
             score = sum(expected_hhs[i:i+6]) / 100.0
@@ -58,6 +75,9 @@ class PotentialLitter(object):
             "avg-total-defect-alleles": sum(expected_defects),
             "avg-health-score": "".join(ratings),
             'total-defect-expected': expected_hh_count,
+            "health-odds": health_odds,
+            "excellent-odds": excellent_odds,
+            "coat-colors": CoatColorGenetics.litter_phenotypes(dad_alleles, mom_alleles),
         }
 
         return litter
@@ -70,6 +90,28 @@ def main():
     parser.add_argument("-o", "--output-file", action="store", help="Output file", default="litters=%s.json")
     parser.add_argument("-m", "--mode", action="store", choices=["file", "interactive"], default="file",
                         help="Mode to run in (%(choices)s - default: %(default)s)")
+    parser.add_argument("-r", "--rank", action="store", choices=sorted(rank_keys.keys()), default="defects",
+                        help="Rank studs by expected defect alleles or by the chance of an all-Excellent pup "
+                             "(%(choices)s - default: %(default)s)")
+    parser.add_argument("-t", "--top", action="store", type=int, default=None,
+                        help="Only keep the best TOP studs for each bitch (default: all of them)")
+    parser.add_argument("-f", "--format", action="store", choices=LitterWriter.formats, default="json",
+                        help="Output format (%(choices)s - default: %(default)s)")
+    parser.add_argument("-p", "--pair-store", action="store", default=None,
+                        help="SQLite file of pairs worked out on earlier runs, only new or changed pairs are redone")
+    parser.add_argument("-s", "--store", action="store", default=None,
+                        help="Kennel store to read the dogs from instead of the input file")
+    parser.add_argument("-j", "--jobs", action="store", type=int, default=1,
+                        help="Number of worker processes to spread the bitches over (default: %(default)s)")
+    parser.add_argument("--coat-floor", action="store", type=float, default=CoatColorGenetics.phenotype_floor,
+                        help="Coat colors less likely than this are listed together as Other, 0 for the full "
+                             "table (default: %(default)s)")
+    parser.add_argument("--no-coat-colors", action="store_true",
+                        help="Leave the coat color odds out of the full output, which saves most of the time")
+    parser.add_argument("--metrics", action="store", default=None,
+                        help="Save the time spent in each stage, per breed and per bitch, to this JSON file")
+    parser.add_argument("--profile", action="store", default=None,
+                        help="Save a cProfile dump of the run to this file")
     args = parser.parse_args()
 
     level = logging.INFO
@@ -78,7 +120,11 @@ def main():
     setup_logging(level)
 
     if args.mode == "file":
-        return process_file(args.input_file, args.output_file)
+        with profiled(args.profile):
+            process_file(args.input_file, args.output_file, args.rank, args.jobs, args.top,
+                         args.format, args.pair_store, args.store, None if args.no_coat_colors else args.coat_floor)
+        if args.metrics:
+            metrics.save(args.metrics)
     elif args.mode == "interactive":
         return process_interactive()
 
@@ -119,18 +165,212 @@ def process_interactive():
         return
 
 
-def process_file(infile, outfile):
+class LitterWriter(object):
+    # Streams the per-bitch records out as they are produced.  "json" gives
+    # the usual indented list of records, "jsonl" one compact record per line.
+    # With no filename, records are simply dropped.
+    formats = ["json", "jsonl"]
+
+    def __init__(self, filename, format_="json"):
+        self.filename = filename
+        self.format = format_
+        self.count = 0
+        self.file = None
+        if filename:
+            self.file = open(filename, "w")
+            if self.format == "json":
+                self.file.write("[")
+
+    @staticmethod
+    def dumps(record, format_="json"):
+        # A record as write() puts it in the file, for records dumped ahead of
+        # time (in the worker processes, say)
+        if format_ == "jsonl":
+            return json.dumps(record, sort_keys=True, separators=(",", ":"))
+        return textwrap.indent(json.dumps(record, indent=2, sort_keys=True), "  ")
+
+    def write(self, record):
+        # record: a dict, or a string from dumps() in this writer's format
+        if not self.file:
+            return
+
+        text = record if isinstance(record, str) else self.dumps(record, self.format)
+        if self.format == "jsonl":
+            self.file.write(text + "\n")
+        else:
+            if self.count:
+                self.file.write(",")
+            self.file.write("\n" + text)
+        self.count += 1
+
+    def close(self):
+        if not self.file:
+            return
+
+        if self.format == "json":
+            self.file.write("\n]" if self.count else "]")
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def summarize_litters(bitch_litters):
+    # The summary output leaves out the bulky per-locus details and the coat
+    # color odds
+    litters = [{key: value for (key, value) in litter.items()
+                if key not in ["defects-map", "genomes", "coat-colors"]}
+               for litter in bitch_litters.get("litters", [])]
+    return dict(bitch_litters, litters=litters)
+
+
+def breed_litters(males, females, rank, top=None, coat_floor=CoatColorGenetics.phenotype_floor):
+    # The unit of work handed to the --jobs worker processes: plain dicts in,
+    # plain dicts out
+    breed = females[0].get("breed", None) if females else None
+    breeder = setup_breeder(breed, males, females, coat_floor)
+
+    out_litters = []
+    for (index, bitch) in enumerate(females):       # Hey, don't blame me, it's the correct term!
+        # Studs are ranked on the cheap score arrays, and only the ones that
+        # are kept get their full litter built
+        name = bitch.get("name", None)
+        with metrics.timer("sort", breed=breed, bitch=name):
+            studs = breeder.ranked_studs(index, rank, top)
+        with metrics.timer("breed", breed=breed, bitch=name):
+            litters = breeder.litters(index, studs)
+        metrics.count("litters", len(litters))
+        out_litters.append({"mom": name, "litters": litters})
+    return out_litters
+
+
+def setup_breeder(breed, males, females, coat_floor=CoatColorGenetics.phenotype_floor):
+    # Parse the genotypes up front, so the parsing shows up as its own stage
+    with metrics.timer("genotype-parse", breed=breed):
+        for dog in males + females:
+            get_genotype(dog.get("genotype", ""))
+    with metrics.timer("breed-setup", breed=breed):
+        return BatchBreeder(males, females, coat_floor)
+
+
+def dump_records(breed, bitch_litters, format_, summary):
+    # (mom, full record, summary record or None), dumped for a LitterWriter
+    with metrics.timer("dump", breed=breed):
+        return (bitch_litters.get("mom", None), LitterWriter.dumps(bitch_litters, format_),
+                LitterWriter.dumps(summarize_litters(bitch_litters), format_) if summary else None)
+
+
+def breed_records(males, females, rank, top, coat_floor, format_, summary):
+    # Worker: breed_litters(), dumped ready for the output files, which spares
+    # the parent process the JSON encoding
+    breed = females[0].get("breed", None) if females else None
+    return [(dump_records(breed, bitch_litters, format_, summary), [])
+            for bitch_litters in breed_litters(males, females, rank, top, coat_floor)]
+
+
+def breed_stored_records(males, females, stored, rank, top, coat_floor, format_, summary):
+    # Worker for runs with a pair store.  stored: for each bitch, the dumped
+    # litters still current in the store, by index into males.  Only the
+    # missing pairs get worked out; they come back dumped for the store, with
+    # the records.
+    breed = females[0].get("breed", None) if females else None
+    breeder = None
+    out = []
+    for (index, bitch) in enumerate(females):
+        name = bitch.get("name", None)
+        with metrics.timer("pair-store", breed=breed):
+            litters = {stud: PairStore.load_litter(text, males[stud], bitch) for (stud, text) in stored[index].items()}
+        missing = [stud for stud in range(len(males)) if stud not in litters]
+        rows = []
+        if missing:
+            if breeder is None:
+                breeder = setup_breeder(breed, males, females, coat_floor)
+            with metrics.timer("breed", breed=breed, bitch=name):
+                bred = breeder.litters(index, missing)
+            metrics.count("litters", len(bred))
+            with metrics.timer("pair-store", breed=breed):
+                rows = [(stud, PairStore.dump_litter(litter)) for (stud, litter) in zip(missing, bred)]
+            litters.update(zip(missing, bred))
+
+        with metrics.timer("sort", breed=breed, bitch=name):
+            litters = sorted([litters[stud] for stud in range(len(males))], key=rank_keys[rank])
+        if top:
+            litters = litters[:top]
+        out.append((dump_records(breed, {"mom": name, "litters": litters}, format_, summary), rows))
+    return out
+
+
+def queue_breed(breed, males, females, rank, top, chunk_size, coat_floor, format_, summary):
+    # (breed, function, args, finish) for each chunk of bitches
+    for start in range(0, len(females), chunk_size):
+        args = (males, females[start:start + chunk_size], rank, top, coat_floor, format_, summary)
+        yield (breed, breed_records, args, None)
+
+
+def queue_stored_breed(store, breed, males, females, rank, top, chunk_size, coat_floor, format_, summary):
+    # Same, but each chunk's stored litters are read from the store as the
+    # chunk is queued, and finish() stores the pairs worked out for it
+    for start in range(0, len(females), chunk_size):
+        chunk = females[start:start + chunk_size]
+        with metrics.timer("pair-store", breed=breed):
+            stored = [store.stored_litters(bitch, males) for bitch in chunk]
+
+        def finish(records, chunk=chunk):
+            with metrics.timer("pair-store", breed=breed):
+                for (bitch, (record, rows)) in zip(chunk, records):
+                    store.put_dumped(bitch, [(males[stud], text) for (stud, text) in rows])
+                store.commit()
+
+        yield (breed, breed_stored_records, (males, chunk, stored, rank, top, coat_floor, format_, summary), finish)
+
+
+def run_tasks(submit, tasks, limit):
+    # (breed, record) for each record of each task, in order.  No more than
+    # limit tasks are handed out ahead of the one being collected, so neither
+    # the queued work nor the finished results pile up in this process.
+    window = deque()
+
+    def collect():
+        (breed, result, finish) = window.popleft()
+        records = result()
+        if finish:
+            finish(records)
+        return [(breed, record) for (record, rows) in records]
+
+    for (breed, function, args, finish) in tasks:
+        window.append((breed, submit(function, *args), finish))
+        if len(window) >= limit:
+            yield from collect()
+    while window:
+        yield from collect()
+
+
+def load_kennel(infile):
     logger.info("Reading kennel list")
-    with open(infile, "r") as f:
+    with metrics.timer("json-load"), open(infile, "r") as f:
         kennel = json.load(f)
+    metrics.count("dogs", len(kennel))
 
     logger.info("Sorting breedable dogs")
+    with metrics.timer("bucket"):
+        return bucket_dogs(kennel)
+
+
+def bucket_dogs(kennel):
     dogs = {}
     for dog in kennel:
         breedable = dog.get("breedable", False)
         if not breedable:
             continue
 
+        if not dog.get("genotype", None):
+            logger.warning("No genotype for %s.  Skipping" % dog.get("name", None))
+            continue
+
         breed = dog.get("breed", None)
         sex = dog.get("sex", None)
         if breed not in dogs:
@@ -138,46 +378,93 @@ def process_file(infile, outfile):
         if sex not in dogs[breed]:
             dogs[breed][sex] = []
         dogs[breed][sex].append(dog)
+    return dogs
+
+
+def process_file(infile, outfile, rank="defects", jobs=1, top=None, format_="json", pair_store=None,
+                 kennel_store=None, coat_floor=CoatColorGenetics.phenotype_floor):
+    if kennel_store:
+        # Only the breedable rows come out of the store, already bucketed
+        with metrics.timer("kennel-store-load"):
+            store = KennelStore(kennel_store)
+            dogs = store.breeding_dogs()
+            store.close()
+    else:
+        dogs = load_kennel(infile)
+
+    if jobs > 1:
+        logger.info("Using %d worker processes" % jobs)
+        executor = process_pool(jobs)
+
+        # The workers send back what they measured along with the results
+        def submit(function, *args):
+            return partial(measured_result, executor.submit(measured, function, *args))
+    else:
+        executor = None
+
+        def submit(function, *args):
+            return partial(function, *args)
+
+    store = None
+    if pair_store:
+        store = PairStore(pair_store, {"coat-floor": coat_floor})
+
+    if '%' in outfile:
+        out_full = outfile % "full"
+        out_summary = outfile % "summary"
+    else:
+        out_full = outfile
+        out_summary = None
+
+    def tasks():
+        # Each breed's bitches go out in a few chunks per worker, to keep the
+        # pickling of the males down
+        for (breed, alldogs) in sorted(dogs.items()):
+            logger.info("Processing breed: %s" % breed)
+            females = alldogs.get("Female", [])
+            males = alldogs.get("Male", [])
+            logger.info("Breedable Females: %d, Breedable Males: %d" % (len(females), len(males)) )
+
+            if not females:
+                logger.info("No breedable females.  Skipping")
+                continue
+
+            if not males:
+                logger.info("No breedable males.  Skipping")
+                continue
+
+            chunk_size = max(1, math.ceil(len(females) / (4 * jobs)))
+            args = (breed, males, females, rank, top, chunk_size, coat_floor, format_, bool(out_summary))
+            if store:
+                yield from queue_stored_breed(store, *args)
+            else:
+                yield from queue_breed(*args)
 
-    out_litters = []
-    for (breed, alldogs) in sorted(dogs.items()):
-        logger.info("Processing breed: %s" % breed)
-        females = alldogs.get("Female", [])
-        males = alldogs.get("Male", [])
-        logger.info("Breedable Females: %d, Breedable Males: %d" % (len(females), len(males)) )
-
-        if not females:
-            logger.info("No breedable females.  Skipping")
-            continue
-
-        if not males:
-            logger.info("No breedable males.  Skipping")
-            continue
-
-        for bitch in females:       # Hey, don't blame me, it's the correct term!
-            logger.info("Processing: %s" % bitch.get("name", None))
-            litters = [PotentialLitter(stud, bitch).litter for stud in males]
-            litters = sorted(litters, key=lambda x: x.get("avg-total-defect-alleles", 9999.99))
-            out_litters.append({"mom": bitch.get("name", None), "litters": litters})
-
-        if '%' in outfile:
-            out_full = outfile % "full"
-            out_summary = outfile % "summary"
+    try:
+        # Each bitch's litters go straight out to the files as they come in
+        with LitterWriter(out_full, format_) as full_writer, \
+                LitterWriter(out_summary, format_) as summary_writer:
+            for (breed, (mom, full, summary)) in run_tasks(submit, tasks(), 2 * jobs):
+                logger.info("Processing: %s" % mom)
+                with metrics.timer("write", breed=breed):
+                    full_writer.write(full)
+                    summary_writer.write(summary)
+                metrics.count("bitches")
+
+        if store:
+            with metrics.timer("pair-store"):
+                store.prune([dog for alldogs in dogs.values() for sex_dogs in alldogs.values() for dog in sex_dogs])
+    finally:
+        if executor:
+            executor.shutdown()
         else:
-            out_full = outfile
-            out_summary = None
-
-        with open(out_full, "w") as f:
-            json.dump(out_litters, f, indent=2, sort_keys=True)
+            logger.info("Genotype cache: %s" % genotype_cache.get_stats())
 
-        for bitch_litters in out_litters:
-            for litter in bitch_litters.get("litters", []):
-                litter.pop("defects-map", None)
-                litter.pop("genomes", None)
+        if store:
+            logger.info("Pair store: %s" % store.get_stats())
+            store.close()
 
-        if out_summary:
-            with open(out_summary, "w") as f:
-                json.dump(out_litters, f, indent=2, sort_keys=True)
+        metrics.log()
 
 
 if __name__ == "__main__":
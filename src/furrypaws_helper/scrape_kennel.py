@@ -1,22 +1,72 @@
 import json
 import logging
 import os
+import pickle
 import re
 import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import Future
+from contextlib import nullcontext
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from laracna.scraper import Scraper
 
-from furrypaws_helper import setup_logging
+from furrypaws_helper import process_pool, setup_logging
+from furrypaws_helper.async_scraper import AsyncScraper
 from furrypaws_helper.config import FurryConfig
+from furrypaws_helper.exceptions import LoginFailed
 from furrypaws_helper.genotype import Genotype
+from furrypaws_helper.kennel_store import KennelStore
+from furrypaws_helper.metrics import measured, measured_result, metrics, profiled
+from furrypaws_helper.page_cache import PageCache
+from furrypaws_helper.parse_cache import ParseCache
+from furrypaws_helper.segment_cache import SegmentCache
 
 logger = logging.getLogger(__name__)
 
+# lxml builds the tree a good deal faster than html.parser, when it's around
+try:
+    import lxml  # noqa: F401
+    html_parser = "lxml"
+except ImportError:
+    html_parser = "html.parser"
+
+
+def wanted_dog_tag(name, attrs):
+    # The only parts of a dog page that dog_response() reads: the about and
+    # history tabs, the overview box and the var_<stat> spans
+    attrs = dict(attrs or {})
+    if attrs.get("id", None) in ["tab_about", "tab_history"]:
+        return True
+
+    classes = attrs.get("class", "")
+    if isinstance(classes, list):
+        classes = " ".join(classes)
+    classes = classes.split()
+    return "dog_overview_holder" in classes or any(item.startswith("var_") for item in classes)
+
+
+def tag_strainer(match):
+    # Parse only the subtrees whose top tag passes match(name, attrs).
+    # beautifulsoup4 4.13 moved this onto ElementFilter, older releases hand
+    # the attributes to a SoupStrainer name function.
+    try:
+        from bs4.filter import ElementFilter
+    except ImportError:
+        return SoupStrainer(lambda name, attrs=None: match(name, attrs))
+
+    class TagFilter(ElementFilter):
+        def allow_tag_creation(self, nsprefix, name, attrs):
+            return match(name, attrs)
+
+    return TagFilter()
+
 
 class KennelScraper(object):
+    kennel_url = "https://www.furry-paws.com/kennel/view/%s/0"
     dog_re = re.compile(r'^https://www.furry-paws.com/dog/index/(?P<id>\d+)/?$')
-    kennel_re = re.compile(r'https://www.furry-paws.com/kennel/view/\d+/\d+/?$')
+    kennel_re = re.compile(r'https://www.furry-paws.com/kennel/view/(?P<kennel>\d+)/\d+/?$')
     age_re = re.compile(r'^(?P<age>\d+) FP Days')
     breed_wait_re = re.compile(r'^(?P<count>\d+)(?:\s+\(Can be bred again in (?P<wait>\d+) days\))?$')
     breed_today_re = re.compile(r'^(?P<count>\d+)(?:\s+\(Can be bred (?P<today>\d+) times today\))?$')
@@ -36,10 +86,14 @@ class KennelScraper(object):
     pedigree_order = ["paternal grandfather", "paternal grandmother",
                       "father", "maternal grandfather", "maternal grandmother",
                       "mother"]
+    dog_strainer = tag_strainer(wanted_dog_tag)
+    link_strainer = SoupStrainer("a", href=True)
+    min_breeding_age = 12
+    max_breeding_age = 110
+    day = 86400
 
     def __init__(self):
         self.callbacks = {
-            "login": self.login_response,
             "kennel": self.kennel_response,
             "dog": self.dog_response,
         }
@@ -47,31 +101,105 @@ class KennelScraper(object):
         self.scraper = Scraper(callbacks=self.callbacks, basedir=self.config.cachedir(), expiry=self.config.expiry())
         self.cookiefile = self.config.cookiefile()
 
-    def login_response(self, response):
-        logger.info("Got login response: code %d" % response.get("code", None))
-        self.scraper.save_cookies(self.cookiefile)
+        # With the segment backend both scrapers share one packed page cache
+        self.cache = None
+        if self.config.cache_backend() == "segment":
+            self.cache = SegmentCache(os.path.join(self.config.cachedir(), "segments"), expiry=self.config.expiry())
+            self.scraper.cache = self.cache
+
+        # Delta mode: id -> record from the last scrape, and the records that
+        # were carried forward from those instead of being fetched again
+        self.previous = None
+        self.carried = {}
+
+        # While scrape() runs: the pool the pages are parsed on, and the
+        # (code, parse cache key, future) of every dog page sent to it
+        self.parse_pool = None
+        self.dog_futures = []
+        self.parse_cache = None
+
+    def parse(self, function, response):
+        if self.parse_pool is None:
+            return function(response)
+        return self.parse_pool.submit(measured, function, response)
 
     def kennel_response(self, response):
         logger.info("Got kennel response: code %d" % response.get("code", None))
+        callback_response = self.parse_cache.get("kennel", response) if self.parse_cache else None
+        if callback_response is None:
+            callback_response = self.parse(self.parse_kennel, response)
+            if self.parse_pool is not None:
+                # The scraper needs the chain back before it can go on
+                callback_response = measured_result(callback_response)
+            if self.parse_cache:
+                self.parse_cache.put("kennel", response, callback_response)
+        callback_response["chain"] = [item for item in callback_response["chain"] if not self.carry_forward(item)]
+        return callback_response
+
+    def dog_response(self, response):
+        logger.info("Got dog response: code %d" % response.get("code", None))
+        key = None
+        callback_response = None
+        if self.parse_cache:
+            key = ParseCache.key("dog", response)
+            callback_response = self.parse_cache.get("dog", response, key)
+
+        if self.parse_pool is None:
+            if callback_response is None:
+                callback_response = self.parse_dog(response)
+                if self.parse_cache:
+                    self.parse_cache.put("dog", response, callback_response, key)
+            return callback_response
+
+        if callback_response is not None:
+            future = Future()
+            future.set_result((callback_response, {}))
+            self.dog_futures.append((response.get("code", None), None, future))
+            return
+
+        # Hand the page over and let the scraper get on with fetching, the
+        # results are picked up once it is done
+        self.dog_futures.append((response.get("code", None), key, self.parse(self.parse_dog, response)))
+
+    # The parsing itself only needs the response, so it can also be run in
+    # worker processes (see AsyncScraper)
+    @classmethod
+    def parse_kennel(cls, response):
+        with metrics.timer("kennel-parse"):
+            return cls.read_kennel(response)
+
+    @classmethod
+    def parse_dog(cls, response):
+        # Includes the genotype-summary stage
+        with metrics.timer("dog-parse"):
+            return cls.read_dog(response)
+
+    @classmethod
+    def read_kennel(cls, response):
         # parse the kennel page, return no response, but a list of dog pages to hit
-        soup = BeautifulSoup(response.get("body", ""), features="html.parser")
+        soup = BeautifulSoup(response.get("body", ""), features=html_parser, parse_only=cls.link_strainer)
         urls = {a['href'] for a in soup.select("a")}
-        dog_urls = list(filter(self.dog_re.search, urls))
-        kennel_urls = list(filter(self.kennel_re.search, urls))
+        dog_urls = list(filter(cls.dog_re.search, urls))
+        # Only page through the kennel being scraped, other kennels are
+        # their own shards
+        match = cls.kennel_re.search(response.get("url", ""))
+        kennel = match.group("kennel") if match else None
+        kennel_urls = [url for url in urls if cls.kennel_re.search(url) and
+                       (kennel is None or cls.kennel_re.search(url).group("kennel") == kennel)]
         items = [{"url": url, "type": "dog"} for url in dog_urls]
         items.extend([{"url": url, "type": "kennel"} for url in kennel_urls])
         return {"chain": items}
 
-    def dog_response(self, response):
-        logger.info("Got dog response: code %d" % response.get("code", None))
+    @classmethod
+    def read_dog(cls, response):
         # parse the dog page, return the data item as a response, and no chain
-        soup = BeautifulSoup(response.get("body", ""), features="html.parser")
+        soup = BeautifulSoup(response.get("body", ""), features=html_parser, parse_only=cls.dog_strainer)
         about_rows = soup.select("div#tab_about tr")
         data = {row.th.get_text().strip(): row.td.get_text().strip()
                 for row in about_rows}
 
-        results = {self.dog_items[key]: value for (key, value) in data.items()
-                   if key in self.dog_items}
+        results = {cls.dog_items[key]: value for (key, value) in data.items()
+                   if key in cls.dog_items}
 
         overview = soup.select("div.dog_overview_holder")
         if overview:
@@ -85,16 +213,17 @@ class KennelScraper(object):
                     results["accepting-requests"] = True
 
         spans = {item: soup.select("[class~=var_%s]" % item)
-                 for item in self.dog_stats}
+                 for item in cls.dog_stats}
         stats = {key: span.pop().get_text() for (key, span) in spans.items()
                  if span}
         results["stats"] = stats
         results["last-update"] = response.get("ctime", 0.0)
-        genotype = Genotype(results.get("genotype", ""))
-        results["summary"] = genotype.get_summary()
+        with metrics.timer("genotype-summary"):
+            genotype = Genotype(results.get("genotype", ""))
+            results["summary"] = genotype.get_summary()
 
         age = 0
-        match = self.age_re.search(results.get("age", ""))
+        match = cls.age_re.search(results.get("age", ""))
         if match:
             age = int(match.group("age"))
             results["age"] = age
@@ -102,7 +231,7 @@ class KennelScraper(object):
         sex = results.get("sex", "")
         wait = 0
         if sex == "Female":
-            match = self.breed_wait_re.search(results.get("bred", ""))
+            match = cls.breed_wait_re.search(results.get("bred", ""))
             if match:
                 wait = match.group("wait")
                 if not wait:
@@ -113,7 +242,7 @@ class KennelScraper(object):
                 results["breed-count"] = count
                 results["breed-wait"] = wait
         else:
-            match = self.breed_today_re.search(results.get("bred", ""))
+            match = cls.breed_today_re.search(results.get("bred", ""))
             if match:
                 today = match.group("today")
                 if not today:
@@ -126,10 +255,10 @@ class KennelScraper(object):
                 if today == 0:
                     wait = 1
 
-        breedable = 12 <= age <= 110 and wait == 0
+        breedable = cls.min_breeding_age <= age <= cls.max_breeding_age and wait == 0
         results["breedable"] = breedable
 
-        match = self.breed_re.search(results.get("breed", ""))
+        match = cls.breed_re.search(results.get("breed", ""))
         if match:
             results["breed"] = match.group("breed")
             results["breed-group"] = match.group("group")
@@ -138,47 +267,293 @@ class KennelScraper(object):
         pedigree_boxes = history_tab.select("div.pedigree_box")
         pedigree_texts = [[text for text in box.stripped_strings]
                           for box in pedigree_boxes]
-        pedigree = {name: pedigree_texts[index] for (index, name) in enumerate(self.pedigree_order)}
+        pedigree = {name: pedigree_texts[index] for (index, name) in enumerate(cls.pedigree_order)}
         results["pedigree"] = pedigree
 
-        match = self.dog_re.search(response.get("url", ""))
+        match = cls.dog_re.search(response.get("url", ""))
         if match:
             results["id"] = int(match.group("id"))
 
         logger.info("Dog: %s" % results["name"])
         return {"results": results}
 
-    def execute(self, output_filename):
-        self.scraper.scrape()
+    @classmethod
+    def predict_dog(cls, record, now, max_age):
+        # Works the record of a dog forward to now, or gives None when that
+        # can't be done with any confidence and the page has to be fetched.
+        # The things that move by themselves are the age (one FP day per day)
+        # and a bitch's breed-wait (counts down).  Anything the owner may have
+        # done in between, i.e. any chance the dog was bred, is not
+        # predictable, so a dog who could have been bred since the last update
+        # is always refetched: a stud's breed-today and breeding count change
+        # with every litter the same as a bitch's wait does.
+        last_update = record.get("last-update", None)
+        age = record.get("age", None)
+        if not last_update or not isinstance(age, int):
+            return None
+
+        # Stats, names and such drift too, so refetch every max_age days
+        if now - record.get("last-fetch", last_update) >= max_age * cls.day:
+            return None
+
+        # Checked even when no whole day has gone by: a dog who was breedable
+        # at the last update may have been bred since
+        days = max(int((now - last_update) // cls.day), 0)
+        female = record.get("sex", "") == "Female"
+        wait = record.get("breed-wait", 0) if female else 0
+        # Breedable at any point since the last update: may have been bred
+        first = max(cls.min_breeding_age - age, wait, 0)
+        if first <= min(days, cls.max_breeding_age - age):
+            return None
+        wait = max(wait - days, 0)
+
+        if days == 0:
+            return record
+
+        predicted = dict(record)
+        predicted["age"] = age + days
+        # Step by whole days so the left over part counts next time
+        predicted["last-update"] = last_update + days * cls.day
+        predicted["last-fetch"] = record.get("last-fetch", last_update)
+        if female:
+            predicted["breed-wait"] = wait
+        predicted["breedable"] = cls.min_breeding_age <= age + days <= cls.max_breeding_age and wait == 0
+        return predicted
+
+    def load_previous(self, output_filename, store_filename=None):
+        # The last scrape, from the kennel store if there is one, else from
+        # the last kennel list
+        if store_filename and os.path.exists(store_filename):
+            store = KennelStore(store_filename)
+            dogs = store.all_dogs()
+            store.close()
+        elif os.path.exists(output_filename):
+            with open(output_filename, "r") as f:
+                dogs = json.load(f)
+        else:
+            dogs = []
+
+        logger.info("Delta scrape against %d dogs" % len(dogs))
+        self.previous = {dog["id"]: dog for dog in dogs if dog.get("id", None) is not None}
+        self.carried = {}
+
+    def carry_forward(self, item):
+        # True when the dog page in item doesn't need fetching, its predicted
+        # record goes in self.carried instead
+        if self.previous is None or item.get("type", None) != "dog":
+            return False
+
+        match = self.dog_re.search(item.get("url", ""))
+        if not match:
+            return False
+
+        id_ = int(match.group("id"))
+        record = self.previous.get(id_, None)
+        if record is None:
+            return False
+
+        predicted = self.predict_dog(record, time.time(), self.config.delta_max_age())
+        if predicted is None:
+            return False
+
+        self.carried[id_] = predicted
+        return True
+
+    def merge_carried(self, results):
+        fetched = {dog.get("id", None) for dog in results}
+        carried = [dog for (id_, dog) in sorted(self.carried.items()) if id_ not in fetched]
+        logger.info("Fetched %d dogs, carried %d forward" % (len(results), len(carried)))
+        return results + carried
 
+    def login(self, session):
+        # Login to the page, using credentials in ~/.furrypaws
+        logger.info("Logging into furrypaws")
+        login_form_data = self.config.get_login_form_data()
+        response = session.request(login_form_data["method"], login_form_data["url"], data=login_form_data["data"],
+                                   headers=login_form_data["headers"])
+        logger.info("Got login response: code %d" % response.status_code)
+        with open(self.cookiefile, "wb") as f:
+            pickle.dump(session.cookies, f)
+
+    def collect_dogs(self):
+        results = []
+        for (code, key, future) in self.dog_futures:
+            try:
+                callback_response = measured_result(future)
+            except Exception:
+                logger.exception("Failed to parse dog page")
+                continue
+            if key and self.parse_cache:
+                self.parse_cache.put("dog", None, callback_response, key)
+            if code // 100 == 2 and callback_response.get("results", None):
+                results.append(callback_response["results"])
+        self.dog_futures = []
+        return results
+
+    @staticmethod
+    def record_fetch(response, *args, **kwargs):
+        # requests response hook: time and count every page fetched
+        metrics.add("fetch", response.elapsed.total_seconds())
+        metrics.count("fetch-%d" % response.status_code)
+
+    def scrape(self, kennels, workers=None):
+        # One laracna scraper per kennel, all running at once on the same
+        # session (and so the same login).  The pages are parsed on a pool of
+        # worker processes, unless workers is 0.
+        if workers != 0:
+            with process_pool(workers) as pool:
+                self.parse_pool = pool
+                try:
+                    return self.run_scrapers(kennels)
+                finally:
+                    self.parse_pool = None
+        return self.run_scrapers(kennels)
+
+    def run_scrapers(self, kennels):
+        scrapers = [self.scraper]
+        for _ in kennels[1:]:
+            scraper = Scraper(callbacks=self.callbacks, basedir=self.config.cachedir(), expiry=self.config.expiry())
+            scraper.session = self.scraper.session
+            if self.cache:
+                scraper.cache = self.cache
+            scrapers.append(scraper)
+
+        self.scraper.session.hooks["response"].append(self.record_fetch)
         if os.path.exists(self.cookiefile):
             self.scraper.load_cookies(self.cookiefile)
         else:
-            # Login to the page, using credentials in ~/.furrypaws
-            logger.info("Logging into furrypaws")
-            login_form_data = self.config.get_login_form_data()
-            self.scraper.queue(**login_form_data)
+            self.login(self.scraper.session)
 
-        # And start scraping from the "overview" page to get all of the dogs listed
-        logger.info("Queuing Main kennel")
-        self.scraper.queue(url="https://www.furry-paws.com/kennel/view/1621357/0", type_="kennel")
+        # And start scraping from the "overview" page of each kennel to get all of the dogs listed
+        for (kennel, scraper) in zip(kennels, scrapers):
+            logger.info("Queuing kennel %s" % kennel)
+            scraper.queue(url=self.kennel_url % kennel, type_="kennel")
+            scraper.scrape()
 
-        # Wait for scraper to finish
-        logger.info("Waiting for scraper to finish")
-        self.scraper.wait()
+        # Wait for scrapers to finish
+        logger.info("Waiting for scrapers to finish")
+        for scraper in scrapers:
+            scraper.wait()
 
         logger.info("Grabbing results")
-        results = self.scraper.get_results()
+        results = [dog for scraper in scrapers for dog in scraper.get_results()]
+        return results + self.collect_dogs()
+
+    def scrape_async(self, kennels, concurrency=None, site=None, workers=None):
+        if concurrency is None:
+            concurrency = self.config.concurrency()
+        callbacks = {
+            "kennel": self.parse_kennel,
+            "dog": self.parse_dog,
+        }
+        cache = self.cache
+        if cache is None:
+            cache = PageCache(os.path.join(self.config.cachedir(), "pages"), expiry=self.config.expiry())
+        scraper = AsyncScraper(callbacks=callbacks, cache=cache, concurrency=concurrency, workers=workers,
+                               site=site, skip=self.carry_forward, parse_cache=self.parse_cache,
+                               user_agent=self.scraper.user_agent)
+        scraper.session.hooks["response"].append(self.record_fetch)
+
+        if os.path.exists(self.cookiefile):
+            scraper.load_cookies(self.cookiefile)
+        else:
+            logger.info("Logging into furrypaws")
+            scraper.login(**self.config.get_login_form_data())
+            scraper.save_cookies(self.cookiefile)
+
+        # The kennels all go through the one queue, so they share the session,
+        # the per host limit and the visited dogs
+        logger.info("Scraping kennels %s with %d requests per host" % (", ".join(kennels), concurrency))
+        try:
+            return scraper.scrape([{"url": self.kennel_url % kennel, "type": "kennel"} for kennel in kennels])
+        except LoginFailed:
+            logger.error("The saved login has run out, remove %s to log in again" % self.cookiefile)
+            raise
+
+    @staticmethod
+    def merge_dogs(results):
+        # A dog can turn up in more than one kennel, keep its latest record
+        dogs = {}
+        merged = []
+        for dog in results:
+            id_ = dog.get("id", None)
+            if id_ is None:
+                merged.append(dog)
+            elif id_ not in dogs or dog.get("last-update", 0.0) > dogs[id_].get("last-update", 0.0):
+                dogs[id_] = dog
+        return [dogs[id_] for id_ in sorted(dogs)] + merged
+
+    def execute(self, output_filename=None, store_filename=None, use_async=False, concurrency=None, site=None,
+                delta=False, kennels=None, workers=None):
+        if output_filename is None:
+            output_filename = self.config.kennel_list()
+        if kennels is None:
+            kennels = self.config.kennels()
+
+        if delta:
+            self.load_previous(output_filename, store_filename)
+
+        # The segment cache, when that is the backend, is done with once the
+        # pages are in
+        self.parse_cache = ParseCache(self.config.parse_cache(), expiry=self.config.expiry())
+        try:
+            with self.cache if self.cache is not None else nullcontext():
+                if use_async:
+                    results = self.scrape_async(kennels, concurrency, site, workers)
+                else:
+                    results = self.scrape(kennels, workers)
+            logger.info("Parse cache: %s" % self.parse_cache.get_stats())
+        finally:
+            self.parse_cache.close()
+            self.parse_cache = None
+
+        if delta:
+            results = self.merge_carried(results)
+        results = self.merge_dogs(results)
+        metrics.count("dogs", len(results))
+        metrics.log()
 
         logger.info("Saving results to %s" % output_filename)
         with open(output_filename, "w") as f:
             json.dump(results, f, indent=2, sort_keys=True)
 
+        if store_filename:
+            store = KennelStore(store_filename)
+            store.replace(results)
+            store.close()
+
 
 def main():
+    parser = ArgumentParser(description="Scrape the kennel")
+    parser.add_argument("-o", "--output-file", action="store", default=None,
+                        help="Output file (default: kennel-list in the config, or kennel-list.json)")
+    parser.add_argument("-k", "--kennel", action="append", dest="kennels", default=None,
+                        help="Kennel id to scrape, may be repeated (default: kennels in the config)")
+    parser.add_argument("-s", "--store", action="store", default=None,
+                        help="Also save the dogs to this kennel store, replacing the dogs stored before")
+    parser.add_argument("-a", "--async", action="store_true", dest="use_async",
+                        help="Scrape with concurrent, conditional requests and parse in worker processes")
+    parser.add_argument("-c", "--concurrency", action="store", type=int, default=None,
+                        help="Requests in flight per host with --async (default: concurrency in the config, or 4)")
+    parser.add_argument("--site", action="store", default=None,
+                        help="With --async, fetch from this server instead of furry-paws.com (e.g. a local copy)")
+    parser.add_argument("-w", "--workers", action="store", type=int, default=None,
+                        help="Processes to parse the pages on (default: one per CPU, 0: parse in the scraper threads)")
+    parser.add_argument("--metrics", action="store", default=None,
+                        help="Save the time spent fetching and parsing to this JSON file")
+    parser.add_argument("--profile", action="store", default=None,
+                        help="Save a cProfile dump of the run to this file")
+    parser.add_argument("-D", "--delta", action="store_true",
+                        help="Only fetch the dogs that are new or may have changed since the last scrape")
+    args = parser.parse_args()
+
     setup_logging(logging.DEBUG)
     kennel_scraper = KennelScraper()
-    kennel_scraper.execute("kennel-list.json")
+    with profiled(args.profile):
+        kennel_scraper.execute(args.output_file, args.store, use_async=args.use_async, concurrency=args.concurrency,
+                               site=args.site, delta=args.delta, kennels=args.kennels, workers=args.workers)
+    if args.metrics:
+        metrics.save(args.metrics)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,236 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentCache(object):
+    # Page cache packed into one append-only segment file instead of a file
+    # per page.  Works as laracna's HttpCache (get/put) and as PageCache
+    # (lookup/put/refresh), so it can back either scraper.
+    #
+    # Each record is a header, the url, the validators as JSON and the body.
+    # Pages are only ever appended, a later record for the same url wins, and
+    # a "refresh" record (no body) just restarts the expiry of the page before
+    # it.  The offsets of the live pages are held in memory and the bodies are
+    # read through an mmap of the segment.
+    #
+    # compact() writes the live pages out to a new segment, dropping expired
+    # pages that have no validators to revalidate them with and any page
+    # not used for retain seconds.  It runs on open when most of the
+    # segment is dead.
+    #
+    # Only one process may write to a segment at a time.
+    header = struct.Struct("<BdiIII")
+    page_record = 0
+    refresh_record = 1
+    filename = "pages.seg"
+
+    def __init__(self, basedir, expiry=None, retain=None):
+        os.makedirs(basedir, 0o755, exist_ok=True)
+        self.basedir = basedir
+        self.path = os.path.join(basedir, self.filename)
+
+        if not expiry:
+            expiry = 3600.0
+        self.expiry = expiry
+        if not retain:
+            retain = 7 * 86400
+        self.retain = max(retain, expiry)
+
+        self.lock = Lock()
+        self.open()
+        if self.garbage() > self.size // 2:
+            self.compact()
+
+    def open(self):
+        # url -> (body offset, body length, ctime, code, validators)
+        self.index = {}
+        self.size = 0
+        self.dead = 0
+        with open(self.path, "ab"):
+            pass
+
+        with open(self.path, "rb") as f:
+            end = os.fstat(f.fileno()).st_size
+            offset = 0
+            while offset + self.header.size <= end:
+                (kind, ctime, code, url_length, meta_length, body_length) = self.header.unpack(
+                    f.read(self.header.size))
+                body_offset = offset + self.header.size + url_length + meta_length
+                if body_offset + body_length > end:
+                    break
+                url = f.read(url_length).decode("utf-8")
+                meta = json.loads(f.read(meta_length).decode("utf-8") or "{}")
+                f.seek(body_length, os.SEEK_CUR)
+                self.apply(kind, url, offset, body_offset, body_length, ctime, code, meta)
+                offset = body_offset + body_length
+
+        if offset < end:
+            # A write that didn't finish, drop it
+            logger.warning("Truncating %s from %d to %d bytes" % (self.path, end, offset))
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+        self.size = offset
+
+        # Appends go on the end whatever the position, and the mmap needs
+        # the file open for reading as well
+        self.file = open(self.path, "a+b")
+        self.map = None
+        self.mapped = 0
+        logger.info("Opened cache segment %s: %d pages, %d of %d bytes dead" %
+                    (self.path, len(self.index), self.dead, self.size))
+
+    def keep(self, entry, now):
+        (ctime, meta) = (entry[2], entry[4])
+        return now < ctime + self.expiry or (any(meta.values()) and now < ctime + self.retain)
+
+    def garbage(self):
+        # Bytes compact() would get rid of
+        now = time.time()
+        return self.dead + sum(self.record_size(url, entry) for (url, entry) in self.index.items()
+                               if not self.keep(entry, now))
+
+    def apply(self, kind, url, offset, body_offset, body_length, ctime, code, meta):
+        old = self.index.get(url, None)
+        if kind == self.refresh_record:
+            self.dead += body_offset - offset
+            if old is not None:
+                self.index[url] = old[:2] + (ctime,) + old[3:]
+            return
+
+        if old is not None:
+            self.dead += self.record_size(url, old)
+        self.index[url] = (body_offset, body_length, ctime, code, meta)
+
+    def record_size(self, url, entry):
+        return self.header.size + len(url.encode("utf-8")) + len(self.encode_meta(entry[4])) + entry[1]
+
+    @staticmethod
+    def encode_meta(meta):
+        meta = {key: value for (key, value) in meta.items() if value}
+        return json.dumps(meta, sort_keys=True).encode("utf-8") if meta else b""
+
+    def append(self, kind, url, code, meta, body, ctime=None):
+        if ctime is None:
+            ctime = time.time()
+        url_bytes = url.encode("utf-8")
+        meta_bytes = self.encode_meta(meta)
+        offset = self.size
+        self.file.write(self.header.pack(kind, ctime, code, len(url_bytes), len(meta_bytes), len(body)))
+        self.file.write(url_bytes)
+        self.file.write(meta_bytes)
+        self.file.write(body)
+        self.file.flush()
+        body_offset = offset + self.header.size + len(url_bytes) + len(meta_bytes)
+        self.size = body_offset + len(body)
+        self.apply(kind, url, offset, body_offset, len(body), ctime, code, meta)
+
+    def read(self, url):
+        # (index entry, memoryview of the body straight out of the mmap) for
+        # url, or None.  Both are taken under the lock, so an append can't
+        # swap the entry between the two.
+        with self.lock:
+            entry = self.index.get(url, None)
+            if entry is None:
+                return None
+            (offset, length) = entry[:2]
+            if offset + length > self.mapped:
+                # Grown since it was mapped.  Views of the old map keep it
+                # alive for as long as they need it.
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+                self.mapped = self.size
+            if not length:
+                return entry, memoryview(b"")
+            return entry, memoryview(self.map)[offset:offset + length]
+
+    def view(self, url):
+        # memoryview of the cached body, no copy made, or None
+        found = self.read(url)
+        return found[1] if found else None
+
+    def lookup(self, url):
+        # The cached page, fresh or not, with "fresh" set; None when not cached.
+        # The callbacks want text, so this one does copy the body.
+        found = self.read(url)
+        if found is None:
+            return None
+        ((offset, length, ctime, code, meta), view) = found
+        body = str(view, "utf-8")
+        view.release()
+        return {
+            "code": code,
+            "url": url,
+            "body": body,
+            "ctime": ctime,
+            "etag": meta.get("etag", None),
+            "last-modified": meta.get("last-modified", None),
+            "fresh": time.time() < ctime + self.expiry,
+        }
+
+    def get(self, url):
+        # Same as HttpCache.get(): only hands back pages that have not expired
+        item = self.lookup(url)
+        if item is None or not item["fresh"]:
+            return None
+        return item
+
+    def put(self, url, code, body, etag=None, last_modified=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        with self.lock:
+            self.append(self.page_record, url, code, {"etag": etag, "last-modified": last_modified}, body)
+
+    def refresh(self, url):
+        # The server says the page has not changed: start its expiry over
+        with self.lock:
+            if url in self.index:
+                self.append(self.refresh_record, url, 0, {}, b"")
+
+    def compact(self):
+        now = time.time()
+        with self.lock:
+            keep = [(url, entry) for (url, entry) in self.index.items() if self.keep(entry, now)]
+            logger.info("Compacting %s: keeping %d of %d pages" % (self.path, len(keep), len(self.index)))
+
+            source = self.map if self.mapped >= self.size else None
+            if source is None and self.size:
+                source = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.file.close()
+
+            new_path = self.path + ".new"
+            with open(new_path, "wb") as f:
+                for (url, (offset, length, ctime, code, meta)) in keep:
+                    url_bytes = url.encode("utf-8")
+                    meta_bytes = self.encode_meta(meta)
+                    f.write(self.header.pack(self.page_record, ctime, code, len(url_bytes), len(meta_bytes), length))
+                    f.write(url_bytes)
+                    f.write(meta_bytes)
+                    f.write(source[offset:offset + length])
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(new_path, self.path)
+            self.open()
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                try:
+                    self.map.close()
+                except BufferError:
+                    # Someone still holds a view(), it goes when they do
+                    pass
+            self.map = None
+            self.mapped = 0
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,167 @@
+import hashlib
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from furrypaws_helper.async_scraper import AsyncScraper
+from furrypaws_helper.exceptions import LoginFailed
+from furrypaws_helper.page_cache import PageCache
+
+origin = AsyncScraper.origin
+dog_ids = [101, 102, 103]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # A few pages shaped like the site's: one kennel page linking to its dogs,
+    # with ETags so they can be revalidated, and a login that sets a cookie
+    def page(self):
+        if self.path == "/kennel/view/1/0":
+            links = "".join('<a href="%s/dog/index/%d">dog</a>' % (origin, id_) for id_ in dog_ids)
+            return "<html><body>%s</body></html>" % links
+        match = re.match(r"^/dog/index/(\d+)$", self.path)
+        if match and int(match.group(1)) in dog_ids:
+            return "<html><body><h1>Dog %s</h1></body></html>" % match.group(1)
+        return None
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("User-Agent", None)))
+        if self.path == "/":
+            return self.send_body(200, "<html><body>Log in</body></html>")
+        if self.server.need_login and "session=ok" not in self.headers.get("Cookie", ""):
+            self.send_response(302)
+            self.send_header("Location", "/")
+            self.end_headers()
+            return
+
+        body = self.page()
+        if body is None:
+            return self.send_body(404, "Not here")
+        etag = '"%s"' % hashlib.md5(body.encode("utf-8")).hexdigest()
+        if self.headers.get("If-None-Match", None) == etag:
+            self.server.not_modified += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_body(200, body, {"ETag": etag})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = self.rfile.read(length).decode("utf-8")
+        if "password=right" not in data:
+            return self.send_body(200, "<html><body>Wrong password</body></html>")
+        self.send_body(200, "<html><body>Welcome</body></html>", {"Set-Cookie": "session=ok; Path=/"})
+
+    def send_body(self, code, body, headers=None):
+        data = body.encode("utf-8")
+        self.send_response(code)
+        for (header, value) in (headers or {}).items():
+            self.send_header(header, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def site():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.requests = []
+    server.not_modified = 0
+    server.need_login = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = "http://127.0.0.1:%d" % server.server_address[1]
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+# Callbacks run in worker processes, so they have to be picklable
+def parse_kennel(item):
+    urls = re.findall(r'href="([^"]+)"', item["body"])
+    return {"chain": [{"url": url, "type": "dog"} for url in urls]}
+
+
+def parse_dog(item):
+    match = re.search(r"<h1>Dog (\d+)</h1>", item["body"])
+    return {"results": {"id": int(match.group(1)), "url": item["url"]}}
+
+
+def make_scraper(site, cache, **kwargs):
+    return AsyncScraper(callbacks={"kennel": parse_kennel, "dog": parse_dog}, cache=cache, concurrency=2,
+                        workers=1, site=site.url, min_delay=0.0, max_delay=0.0, **kwargs)
+
+
+def kennel_items():
+    return [{"url": origin + "/kennel/view/1/0", "type": "kennel"}]
+
+
+def test_fetches_and_parses(site, tmp_path):
+    scraper = make_scraper(site, PageCache(str(tmp_path)), user_agent="stand-in test")
+    results = scraper.scrape(kennel_items())
+
+    assert sorted(dog["id"] for dog in results) == dog_ids
+    assert {dog["url"] for dog in results} == {"%s/dog/index/%d" % (origin, id_) for id_ in dog_ids}
+    assert len(site.requests) == 1 + len(dog_ids)
+    assert {agent for (path, agent) in site.requests} == {"stand-in test"}
+    assert scraper.stats["requests"] == 1 + len(dog_ids)
+
+
+def test_fresh_pages_come_from_the_cache(site, tmp_path):
+    make_scraper(site, PageCache(str(tmp_path))).scrape(kennel_items())
+    del site.requests[:]
+
+    scraper = make_scraper(site, PageCache(str(tmp_path)))
+    results = scraper.scrape(kennel_items())
+    assert sorted(dog["id"] for dog in results) == dog_ids
+    assert site.requests == []
+    assert scraper.stats["cached"] == 1 + len(dog_ids)
+
+
+def test_stale_pages_are_revalidated(site, tmp_path):
+    make_scraper(site, PageCache(str(tmp_path))).scrape(kennel_items())
+
+    # Expired straight away, so every page is asked for again
+    cache = PageCache(str(tmp_path), expiry=1e-9)
+    scraper = make_scraper(site, cache)
+    results = scraper.scrape(kennel_items())
+    assert sorted(dog["id"] for dog in results) == dog_ids
+    assert site.not_modified == 1 + len(dog_ids)
+    assert scraper.stats["revalidated"] == 1 + len(dog_ids)
+
+
+def test_error_pages_are_not_cached(site, tmp_path):
+    cache = PageCache(str(tmp_path))
+    url = origin + "/dog/index/999"
+    results = make_scraper(site, cache).scrape([{"url": url, "type": "dog"}])
+    assert results == []
+    assert cache.lookup(url) is None
+
+
+def test_login(site, tmp_path):
+    site.need_login = True
+    scraper = make_scraper(site, PageCache(str(tmp_path)))
+    with pytest.raises(LoginFailed):
+        scraper.login(origin + "/", data={"username": "me", "password": "wrong"})
+
+    scraper.login(origin + "/", data={"username": "me", "password": "right"})
+    results = scraper.scrape(kennel_items())
+    assert sorted(dog["id"] for dog in results) == dog_ids
+
+
+def test_not_logged_in_fails(site, tmp_path):
+    site.need_login = True
+    scraper = make_scraper(site, PageCache(str(tmp_path)))
+    with pytest.raises(LoginFailed):
+        scraper.scrape(kennel_items())
+
+
+def test_parses_inline_without_workers(site, tmp_path):
+    scraper = AsyncScraper(callbacks={"kennel": parse_kennel, "dog": parse_dog}, cache=PageCache(str(tmp_path)),
+                           workers=0, site=site.url, min_delay=0.0, max_delay=0.0)
+    results = scraper.scrape(kennel_items())
+    assert sorted(dog["id"] for dog in results) == dog_ids
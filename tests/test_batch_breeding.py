@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from furrypaws_helper.batch_breeding import BatchBreeder
+from furrypaws_helper.benchmark import random_genotype
+from furrypaws_helper.potential_litter import PotentialLitter, rank_keys
+
+
+def dogs(rng, prefix, count):
+    return [{"id": index, "name": "%s %d" % (prefix, index), "genotype": random_genotype(rng)}
+            for index in range(count)]
+
+
+@pytest.fixture(scope="module")
+def kennel():
+    rng = random.Random(11)
+    return dogs(rng, "Stud", 7), dogs(rng, "Bitch", 5)
+
+
+def assert_same(litter, expected):
+    assert set(litter) == set(expected)
+    for (key, value) in expected.items():
+        if key == "health-odds":
+            for (block, odds) in value.items():
+                assert litter[key][block] == pytest.approx(odds), (key, block)
+        elif isinstance(value, float) or key in ["defects-map", "coat-colors"]:
+            assert litter[key] == pytest.approx(value), key
+        else:
+            assert litter[key] == value, key
+
+
+def test_litters_match_potential_litter(kennel):
+    (studs, bitches) = kennel
+    breeder = BatchBreeder(studs, bitches)
+    for (bitch_index, bitch) in enumerate(bitches):
+        litters = breeder.litters(bitch_index)
+        assert len(litters) == len(studs)
+        for (stud, litter) in zip(studs, litters):
+            assert_same(litter, PotentialLitter(stud, bitch).litter)
+
+
+@pytest.mark.parametrize("rank", sorted(rank_keys))
+def test_ranked_studs_match_sorting(kennel, rank):
+    (studs, bitches) = kennel
+    breeder = BatchBreeder(studs, bitches)
+    for (bitch_index, bitch) in enumerate(bitches):
+        expected = sorted((PotentialLitter(stud, bitch).litter for stud in studs), key=rank_keys[rank])
+        ranked = breeder.litters(bitch_index, breeder.ranked_studs(bitch_index, rank, 3))
+        assert [rank_keys[rank](litter) for litter in ranked] == \
+            pytest.approx([rank_keys[rank](litter) for litter in expected[:3]])
+
+
+def test_coat_colors_can_be_left_out(kennel):
+    (studs, bitches) = kennel
+    litters = BatchBreeder(studs, bitches, coat_floor=None).litters(0)
+    assert all("coat-colors" not in litter for litter in litters)
@@ -0,0 +1,113 @@
+import itertools
+import json
+import os
+import random
+from collections import defaultdict
+
+import pytest
+
+from furrypaws_helper.benchmark import random_genotype
+from furrypaws_helper.genetics_base import BaseGenetics
+from furrypaws_helper.genetics_coat import CoatColorGenetics
+from furrypaws_helper.genetics_health import HealthGenetics
+from furrypaws_helper.genotype import Genotype
+
+# Coat and eye summaries of random genotypes, as the original (pre-lookup
+# table) interpreters worked them out
+with open(os.path.join(os.path.dirname(__file__), "data", "summaries.json"), "r") as f:
+    corpus = json.load(f)
+
+
+@pytest.mark.parametrize("trait", ["coat-color", "eye-color"])
+def test_summaries_match_corpus(trait):
+    for entry in corpus:
+        assert Genotype(entry["genotype"]).get_summary()[trait] == entry[trait], entry["genotype"]
+
+
+def alleles(rng):
+    return BaseGenetics.split_genomes(random_genotype(rng).split())
+
+
+def pup_odds(dad_pair, mom_pair):
+    # Sorted pup allele pair -> chance at one locus
+    odds = defaultdict(float)
+    for dad in dad_pair:
+        for mom in mom_pair:
+            odds[tuple(sorted([dad, mom]))] += 0.25
+    return list(odds.items())
+
+
+def test_rating_odds_match_enumeration():
+    rng = random.Random(7)
+    for _ in range(20):
+        (dad, mom) = (alleles(rng), alleles(rng))
+        (odds, excellent) = HealthGenetics.rating_odds(dad, mom)
+
+        expected_excellent = 1.0
+        for (block, start) in zip(HealthGenetics.blocks, range(17, 41, HealthGenetics.block_size)):
+            assert sum(odds[block].values()) == pytest.approx(1.0)
+
+            expected = defaultdict(float)
+            loci = [pup_odds(dad[index], mom[index]) for index in range(start, start + HealthGenetics.block_size)]
+            for combo in itertools.product(*loci):
+                chance = 1.0
+                for (pair, pair_chance) in combo:
+                    chance *= pair_chance
+                defects = sum(pair == ("h", "h") for (pair, pair_chance) in combo)
+                expected[HealthGenetics.rating_for(defects)] += chance
+            for (rating, chance) in odds[block].items():
+                assert chance == pytest.approx(expected.get(rating, 0.0))
+            expected_excellent *= expected.get("E", 0.0)
+        assert excellent == pytest.approx(expected_excellent)
+
+
+def brute_force_phenotypes(dad, mom):
+    # Every combination of pup genomes at the coat loci, each put through
+    # the single dog coat summary
+    loci = [pup_odds(dad[index], mom[index]) for index in range(1, 14)]
+    odds = defaultdict(float)
+    for combo in itertools.product(*loci):
+        pup = [list(pair) for pair in dad]
+        chance = 1.0
+        for (index, (pair, pair_chance)) in enumerate(combo, 1):
+            pup[index] = list(pair)
+            chance *= pair_chance
+        genomes = ["".join(pair) for pair in pup]
+        odds[CoatColorGenetics(genomes, pup).get_summary()] += chance
+    return odds
+
+
+def small_pairs(rng, count, limit=4096):
+    # Random pairs with few enough coat genome combinations to enumerate
+    pairs = []
+    while len(pairs) < count:
+        (dad, mom) = (alleles(rng), alleles(rng))
+        combinations = 1
+        for index in range(1, 14):
+            combinations *= len(pup_odds(dad[index], mom[index]))
+        if combinations <= limit:
+            pairs.append((dad, mom))
+    return pairs
+
+
+def test_coat_phenotypes_match_enumeration():
+    for (dad, mom) in small_pairs(random.Random(8), 12):
+        dad_coat = tuple(tuple(pair) for pair in dad[1:14])
+        mom_coat = tuple(tuple(pair) for pair in mom[1:14])
+        odds = CoatColorGenetics.coat_phenotypes(dad_coat, mom_coat)
+        expected = brute_force_phenotypes(dad, mom)
+        assert set(odds) == set(expected)
+        for (phenotype, chance) in expected.items():
+            assert odds[phenotype] == pytest.approx(chance)
+
+
+@pytest.mark.parametrize("floor", [0, 0.01, 0.2])
+def test_litter_phenotypes_add_up(floor):
+    rng = random.Random(9)
+    for _ in range(20):
+        (dad, mom) = (alleles(rng), alleles(rng))
+        odds = CoatColorGenetics.litter_phenotypes(dad, mom, floor)
+        assert sum(odds.values()) == pytest.approx(1.0)
+        assert all(chance >= floor for (phenotype, chance) in odds.items() if phenotype != "Other")
+        if not floor:
+            assert "Other" not in odds
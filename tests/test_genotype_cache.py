@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+from furrypaws_helper.benchmark import random_genotype
+from furrypaws_helper.genetics_base import BaseGenetics
+from furrypaws_helper.genotype import Genotype, GenotypeCache
+
+
+def test_cached_genotype_matches_genotype():
+    text = random_genotype(random.Random(1))
+    cached = GenotypeCache().get(text)
+    genotype = Genotype(text)
+    assert [list(pair) for pair in cached.alleles] == BaseGenetics.split_genomes(text.split())
+    assert dict(cached.summary) == genotype.get_summary()
+    assert cached.text == genotype.text
+
+
+def test_same_text_same_genotype():
+    cache = GenotypeCache()
+    text = random_genotype(random.Random(2))
+    assert cache.get(text) is cache.get("  %s\n" % text)
+    assert cache.get_stats()["hits"] == 1
+
+
+def test_cached_genotypes_cannot_be_changed():
+    cache = GenotypeCache()
+    text = random_genotype(random.Random(3))
+    genotype = cache.get(text)
+    with pytest.raises(TypeError):
+        genotype.summary["coat-color"] = "Purple"
+    with pytest.raises(TypeError):
+        genotype.alleles[0] = ("a", "a")
+    with pytest.raises(AttributeError):
+        genotype.summary = {}
+    with pytest.raises(AttributeError):
+        genotype.compact.loci = b""
+    assert dict(cache.get(text).summary) == Genotype(text).get_summary()
+
+
+def test_cache_is_bounded():
+    cache = GenotypeCache(maxsize=3)
+    rng = random.Random(4)
+    for _ in range(5):
+        cache.get(random_genotype(rng))
+    stats = cache.get_stats()
+    assert (stats["size"], stats["evictions"]) == (3, 2)
@@ -0,0 +1,42 @@
+import pytest
+
+from furrypaws_helper.kennel_store import KennelStore
+
+
+def dog(id_, name, breedable=True, sex="Female"):
+    return {"id": id_, "name": name, "breed": "Akita", "sex": sex, "breedable": breedable, "genotype": "Ee BB"}
+
+
+def test_replace_deletes_missing_dogs(tmp_path):
+    store = KennelStore(str(tmp_path / "kennel.db"))
+    store.replace([dog(3, "Three"), dog(1, "One"), dog(2, "Two")])
+    store.replace([dog(2, "Two again"), dog(4, "Four")])
+    assert [d["name"] for d in store.all_dogs()] == ["Two again", "Four"]
+    assert store.get(1) is None
+    store.close()
+
+
+def test_upsert_keeps_missing_dogs(tmp_path):
+    store = KennelStore(str(tmp_path / "kennel.db"))
+    store.replace([dog(3, "Three"), dog(1, "One")])
+    store.upsert([dog(2, "Two"), dog(1, "One again", breedable=False)])
+    assert [d["name"] for d in store.all_dogs()] == ["Three", "Two", "One again"]
+    assert [d["name"] for d in store.dogs("Akita", "Female")] == ["Three", "Two"]
+    store.close()
+
+
+def test_replace_skips_dogs_without_id(tmp_path):
+    store = KennelStore(str(tmp_path / "kennel.db"))
+    store.replace([dog(1, "One"), dog(None, "Nobody")])
+    assert [d["name"] for d in store.all_dogs()] == ["One"]
+    assert [d["name"] for d in store.find_genotype(" Ee BB ")] == ["One"]
+    store.close()
+
+
+def test_replace_is_all_or_nothing(tmp_path):
+    store = KennelStore(str(tmp_path / "kennel.db"))
+    store.replace([dog(1, "One"), dog(2, "Two")])
+    with pytest.raises(TypeError):
+        store.replace([dog(1, "One again"), dog(3, object())])
+    assert [d["name"] for d in store.all_dogs()] == ["One", "Two"]
+    store.close()
@@ -0,0 +1,82 @@
+import json
+import random
+
+from furrypaws_helper.benchmark import random_genotype
+from furrypaws_helper.pair_store import PairStore
+from furrypaws_helper.potential_litter import process_file
+
+
+def dog(rng, id_, sex, breed="Akita"):
+    return {"id": id_, "name": "Dog %s" % id_, "sex": sex, "breed": breed, "breedable": True,
+            "genotype": random_genotype(rng)}
+
+
+def test_changed_genotypes_are_missed(tmp_path):
+    rng = random.Random(5)
+    (stud, other, bitch) = (dog(rng, 1, "Male"), dog(rng, 2, "Male"), dog(rng, 3, "Female"))
+    store = PairStore(str(tmp_path / "pairs.db"))
+    store.put_litters(bitch, [(stud, {"stud": "x", "bitch": "y", "odds": 0.5}), (other, {"odds": 0.25})])
+    store.commit()
+
+    assert set(store.stored_litters(bitch, [stud, other])) == {0, 1}
+    renamed = dict(stud, name="Renamed")
+    assert store.get_litters(bitch, [renamed]) == {0: {"stud": "Renamed", "bitch": "Dog 3", "odds": 0.5}}
+
+    changed = dict(other, genotype=random_genotype(rng))
+    assert set(store.stored_litters(bitch, [stud, changed])) == {0}
+    assert set(store.stored_litters(dict(bitch, id=None), [stud])) == set()
+    assert store.get_stats() == {"hits": 4, "misses": 2}
+    store.close()
+
+
+def test_settings_change_drops_pairs(tmp_path):
+    rng = random.Random(6)
+    (stud, bitch) = (dog(rng, 1, "Male"), dog(rng, 2, "Female"))
+    filename = str(tmp_path / "pairs.db")
+    store = PairStore(filename, {"coat-floor": 0.01})
+    store.put_litters(bitch, [(stud, {"odds": 0.5})])
+    store.close()
+
+    store = PairStore(filename, {"coat-floor": 0.01})
+    assert set(store.stored_litters(bitch, [stud])) == {0}
+    store.close()
+    store = PairStore(filename, {"coat-floor": 0.0})
+    assert set(store.stored_litters(bitch, [stud])) == set()
+    store.close()
+
+
+def test_prune(tmp_path):
+    rng = random.Random(7)
+    (stud, gone, bitch) = (dog(rng, 1, "Male"), dog(rng, 2, "Male"), dog(rng, 3, "Female"))
+    store = PairStore(str(tmp_path / "pairs.db"))
+    store.put_litters(bitch, [(stud, {"odds": 0.5}), (gone, {"odds": 0.25})])
+    store.prune([stud, bitch])
+    assert set(store.get_litters(bitch, [stud, gone])) == {0}
+    store.close()
+
+
+def test_process_file_matches_without_store(tmp_path):
+    rng = random.Random(8)
+    kennel = [dog(rng, id_, sex) for (id_, sex) in enumerate(["Male"] * 6 + ["Female"] * 4)]
+    kennel.append(dict(dog(rng, None, "Male"), name="No id"))
+    infile = tmp_path / "kennel.json"
+    infile.write_text(json.dumps(kennel))
+
+    def run(name, **kwargs):
+        process_file(str(infile), str(tmp_path / ("%s=%%s.json" % name)), top=4, **kwargs)
+        return (tmp_path / ("%s=full.json" % name)).read_text()
+
+    expected = run("plain")
+    pairs = str(tmp_path / "pairs.db")
+    assert run("first", pair_store=pairs) == expected
+
+    # A bitch with a new genotype, and a stud gone from the kennel
+    kennel[7]["genotype"] = random_genotype(rng)
+    del kennel[0]
+    infile.write_text(json.dumps(kennel))
+    expected = run("plain")
+    assert run("second", pair_store=pairs) == expected
+
+    store = PairStore(pairs, {"coat-floor": 0.01})
+    assert store.connection.execute("SELECT COUNT(*) FROM pairs WHERE stud_id = '0'").fetchone()[0] == 0
+    store.close()
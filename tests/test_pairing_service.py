@@ -0,0 +1,103 @@
+import json
+import random
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from furrypaws_helper.benchmark import random_genotype
+from furrypaws_helper.pairing_service import PairingHandler, PairingService
+
+
+def dog(rng, id_, sex, breed="Akita", **fields):
+    record = {"id": id_, "name": "Dog %d" % id_, "sex": sex, "breed": breed, "breedable": True,
+              "genotype": random_genotype(rng)}
+    record.update(fields)
+    return record
+
+
+@pytest.fixture
+def kennel(tmp_path):
+    rng = random.Random(12)
+    dogs = [dog(rng, 1, "Male"), dog(rng, 2, "Male"), dog(rng, 3, "Female"), dog(rng, 4, "Female"),
+            dog(rng, 5, "Male", breed="Boxer"), dog(rng, 6, "Female", name="Twin"), dog(rng, 7, "Female", name="Twin"),
+            dog(rng, 8, "Male", genotype="Ee BB")]
+    path = tmp_path / "kennel.json"
+    path.write_text(json.dumps(dogs))
+    return path
+
+
+@pytest.fixture
+def service(kennel):
+    service = PairingService(str(kennel))
+    handler = type("Handler", (PairingHandler,), {"service": service})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    service.url = "http://127.0.0.1:%d" % server.server_address[1]
+    yield service
+    server.shutdown()
+    server.server_close()
+
+
+def request(service, path, method="GET"):
+    # (status, decoded JSON body)
+    try:
+        with urllib.request.urlopen(urllib.request.Request(service.url + path, method=method)) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_pair(service):
+    (status, litter) = request(service, "/pair?stud=1&bitch=Dog%203")
+    assert status == 200
+    assert (litter["stud"], litter["bitch"]) == ("Dog 1", "Dog 3")
+    assert "coat-colors" not in litter
+    (status, litter) = request(service, "/pair?stud=1&bitch=3&full=1")
+    assert status == 200
+    assert sum(litter["coat-colors"].values()) == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("query", ["stud=3&bitch=4", "stud=1&bitch=2", "stud=5&bitch=3", "stud=1", "stud=1&bitch=Twin",
+                                   "stud=8&bitch=3"])
+def test_bad_pairs(service, query):
+    (status, body) = request(service, "/pair?" + query)
+    assert status == 400
+    assert body["error"]
+
+
+@pytest.mark.parametrize("path", ["/pair?stud=1&bitch=99", "/nothing"])
+def test_not_found(service, path):
+    assert request(service, path)[0] == 404
+
+
+def test_unexpected_errors(service, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("Oops")
+
+    monkeypatch.setattr(service, "score_pair", fail)
+    assert request(service, "/pair?stud=1&bitch=3") == (500, {"error": "RuntimeError: Oops"})
+
+
+def test_best_studs(service):
+    (status, result) = request(service, "/best-studs?bitch=3&top=1&rank=excellent")
+    assert status == 200
+    assert (result["mom"], result["rank"], len(result["litters"])) == ("Dog 3", "excellent", 1)
+    assert request(service, "/best-studs?bitch=3&rank=best")[0] == 400
+
+
+def test_status_and_reload(service, kennel):
+    request(service, "/pair?stud=1&bitch=3")
+    (status, stats) = request(service, "/status")
+    assert status == 200
+    assert (stats["dogs"], stats["breeds"], stats["queries"]) == (8, 2, 1)
+
+    dogs = json.loads(kennel.read_text())
+    kennel.write_text(json.dumps(dogs[:4]))
+    assert request(service, "/reload", "POST") == (200, {"reloaded": True})
+    assert request(service, "/status")[1]["dogs"] == 4
+    assert request(service, "/pair?stud=5&bitch=3")[0] == 404
+    assert request(service, "/elsewhere", "POST")[0] == 404
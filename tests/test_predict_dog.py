@@ -0,0 +1,56 @@
+from furrypaws_helper.scrape_kennel import KennelScraper
+
+day = KennelScraper.day
+now = 1700000000.0
+
+
+def dog(**fields):
+    record = {"id": 1, "name": "Dog 1", "age": 30, "last-update": now - 3600}
+    record.update(fields)
+    return record
+
+
+def test_breedable_bitch_is_refetched_the_same_day():
+    bitch = dog(sex="Female", **{"breed-wait": 0, "breedable": True})
+    assert KennelScraper.predict_dog(bitch, now, 30) is None
+
+
+def test_breedable_stud_is_refetched_the_same_day():
+    for breed_today in [0, 2]:
+        stud = dog(sex="Male", **{"breed-today": breed_today, "breedable": True})
+        assert KennelScraper.predict_dog(stud, now, 30) is None
+
+
+def test_young_stud_is_worked_forward():
+    stud = dog(sex="Male", age=5, **{"breed-today": 0, "breedable": False, "last-update": now - 3 * day - 60})
+    predicted = KennelScraper.predict_dog(stud, now, 30)
+    assert (predicted["age"], predicted["breedable"], predicted["breed-today"]) == (8, False, 0)
+
+
+def test_stud_coming_of_age_is_refetched():
+    stud = dog(sex="Male", age=10, **{"breed-today": 0, "breedable": False, "last-update": now - 2 * day})
+    assert KennelScraper.predict_dog(stud, now, 30) is None
+
+
+def test_waiting_bitch_is_carried_the_same_day():
+    bitch = dog(sex="Female", **{"breed-wait": 5, "breedable": False})
+    assert KennelScraper.predict_dog(bitch, now, 30) == bitch
+
+
+def test_waiting_bitch_is_worked_forward():
+    bitch = dog(sex="Female", **{"breed-wait": 5, "breedable": False, "last-update": now - 2 * day - 60})
+    predicted = KennelScraper.predict_dog(bitch, now, 30)
+    assert predicted["age"] == 32
+    assert predicted["breed-wait"] == 3
+    assert predicted["last-update"] == bitch["last-update"] + 2 * day
+    assert not predicted["breedable"]
+
+
+def test_bitch_whose_wait_ran_out_is_refetched():
+    bitch = dog(sex="Female", **{"breed-wait": 1, "breedable": False, "last-update": now - 2 * day})
+    assert KennelScraper.predict_dog(bitch, now, 30) is None
+
+
+def test_old_records_are_refetched():
+    stud = dog(sex="Male", **{"breed-today": 2, "last-update": now - 31 * day})
+    assert KennelScraper.predict_dog(stud, now, 30) is None
@@ -0,0 +1,60 @@
+import threading
+
+from furrypaws_helper.segment_cache import SegmentCache
+
+url = "https://www.furry-paws.com/dog/index/1"
+
+
+def test_put_and_lookup(tmp_path):
+    with SegmentCache(str(tmp_path)) as cache:
+        assert cache.lookup(url) is None
+        cache.put(url, 200, "<html>one</html>", etag='"1"')
+        item = cache.lookup(url)
+        assert (item["code"], item["body"], item["etag"], item["fresh"]) == (200, "<html>one</html>", '"1"', True)
+        assert bytes(cache.view(url)) == b"<html>one</html>"
+
+        cache.put(url, 200, "<html>two</html>")
+        assert cache.get(url)["body"] == "<html>two</html>"
+
+
+def test_reopen_and_refresh(tmp_path):
+    with SegmentCache(str(tmp_path), expiry=1e-9) as cache:
+        cache.put(url, 200, "<html>one</html>", etag='"1"')
+        assert not cache.lookup(url)["fresh"]
+        assert cache.get(url) is None
+
+    with SegmentCache(str(tmp_path)) as cache:
+        cache.refresh(url)
+        item = cache.lookup(url)
+        assert (item["body"], item["etag"], item["fresh"]) == ("<html>one</html>", '"1"', True)
+
+
+def test_compact_keeps_live_pages(tmp_path):
+    with SegmentCache(str(tmp_path)) as cache:
+        for index in range(10):
+            cache.put(url, 200, "<html>%d</html>" % index)
+        cache.compact()
+        assert cache.size < 2 * cache.record_size(url, cache.index[url])
+        assert cache.lookup(url)["body"] == "<html>9</html>"
+
+
+def test_lookup_while_appending(tmp_path):
+    with SegmentCache(str(tmp_path)) as cache:
+        cache.put(url, 200, "<html>0</html>")
+        stop = threading.Event()
+
+        def write():
+            index = 0
+            while not stop.is_set():
+                index += 1
+                cache.put(url, 200, "<html>%d</html>" % index)
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        try:
+            for _ in range(2000):
+                body = cache.lookup(url)["body"]
+                assert body.startswith("<html>") and body.endswith("</html>")
+        finally:
+            stop.set()
+            thread.join()